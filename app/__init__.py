@@ -0,0 +1,4 @@
+import time
+
+# Reference point for the startup timing report (app.startup)
+IMPORT_STARTED = time.perf_counter()
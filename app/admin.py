@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+import secrets
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from . import config, database, models, schemas
+from .hashing import password_hasher
+
+# ----------------------------------------
+# Admin Auth
+# ----------------------------------------
+def require_admin(x_admin_token: str = Header(None)):
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, config.ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+EXPORT_FIELDS = ("id", "username", "is_subscribed", "stripe_customer_id")
+
+# ----------------------------------------
+# Streaming Export
+# ----------------------------------------
+def iter_user_pages(is_subscribed: Optional[bool], stripe_customer_id: Optional[str], has_stripe_customer: Optional[bool]):
+    # Keyset pagination on id: each page is an index range scan, and only one page is ever in memory
+    columns = [getattr(models.UserProfile, name) for name in EXPORT_FIELDS]
+    last_id = 0
+    while True:
+        query = (
+            select(*columns)
+            .where(models.UserProfile.id > last_id)
+            .order_by(models.UserProfile.id)
+            .limit(config.ADMIN_EXPORT_PAGE_SIZE)
+        )
+        if is_subscribed is not None:
+            query = query.where(models.UserProfile.is_subscribed.is_(is_subscribed))
+        if stripe_customer_id is not None:
+            query = query.where(models.UserProfile.stripe_customer_id == stripe_customer_id)
+        if has_stripe_customer is not None:
+            customer = models.UserProfile.stripe_customer_id
+            query = query.where(customer.isnot(None) if has_stripe_customer else customer.is_(None))
+
+        # A short-lived session per page, so a slow client never pins a pooled connection
+        db = database.SessionLocal()
+        try:
+            rows = db.execute(query).all()
+        finally:
+            db.close()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def ndjson_lines(pages):
+    for rows in pages:
+        yield "".join(json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n" for row in rows)
+
+
+def csv_lines(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in pages:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@router.get("/users/export")
+def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    is_subscribed: Optional[bool] = None,
+    stripe_customer_id: Optional[str] = None,
+    has_stripe_customer: Optional[bool] = None,
+):
+    pages = iter_user_pages(is_subscribed, stripe_customer_id, has_stripe_customer)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    if format == "csv":
+        body, media_type = csv_lines(pages), "text/csv"
+    else:
+        body, media_type = ndjson_lines(pages), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="users-{stamp}.{format}"'},
+    )
+
+# ----------------------------------------
+# Bulk Import
+# ----------------------------------------
+def existing_usernames(usernames: List[str]) -> set:
+    db = database.SessionLocal()
+    database.use_primary(db)
+    try:
+        found = set()
+        for i in range(0, len(usernames), config.ADMIN_IMPORT_BATCH_SIZE):
+            batch = usernames[i:i + config.ADMIN_IMPORT_BATCH_SIZE]
+            found.update(
+                db.execute(select(models.UserProfile.username).where(models.UserProfile.username.in_(batch))).scalars()
+            )
+        return found
+    finally:
+        db.close()
+
+
+def insert_users(rows: List[dict]) -> set:
+    """Multi-row INSERT ... ON CONFLICT DO NOTHING per batch; returns the usernames actually inserted."""
+    table = models.UserProfile.__table__
+    inserted = set()
+    db = database.SessionLocal()
+    try:
+        for i in range(0, len(rows), config.ADMIN_IMPORT_BATCH_SIZE):
+            batch = rows[i:i + config.ADMIN_IMPORT_BATCH_SIZE]
+            result = db.execute(database.insert_ignore(table).values(batch).returning(table.c.username))
+            inserted.update(result.scalars())
+            db.commit()
+    finally:
+        db.close()
+    return inserted
+
+
+@router.post("/users/import", response_model=schemas.UserImportResult)
+async def import_users(users: List[schemas.UserProfileCreate]):
+    if len(users) > config.ADMIN_IMPORT_MAX_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {config.ADMIN_IMPORT_MAX_USERS} users per import",
+        )
+
+    # Drop repeats within the payload and users that already exist before paying for bcrypt
+    unique = {}
+    duplicates = []
+    for user in users:
+        if user.username in unique:
+            duplicates.append(user.username)
+        else:
+            unique[user.username] = user.password
+    existing = await run_in_threadpool(existing_usernames, list(unique))
+    duplicates.extend(username for username in unique if username in existing)
+    new_users = [(username, password) for username, password in unique.items() if username not in existing]
+
+    hashes = await password_hasher.hash_many([password for _, password in new_users])
+    rows = [
+        {"username": username, "hashed_password": hashed, "is_subscribed": False}
+        for (username, _), hashed in zip(new_users, hashes)
+    ]
+    inserted = await run_in_threadpool(insert_users, rows)
+    # Anything not inserted lost a race with a concurrent signup
+    duplicates.extend(row["username"] for row in rows if row["username"] not in inserted)
+    for username in inserted:
+        database.mark_written(username)
+
+    return {"created": len(inserted), "duplicates": duplicates}
@@ -1,148 +1,249 @@
+import asyncio
+import logging
+import uuid
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import APIRouter, Depends, HTTPException, status, Form
+from jose import JWTError
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from . import models, database, config
+from . import models, database, config, entitlements, refresh_sessions
+from .keys import key_ring
+from .cache import principal_cache
+from .hashing import password_hasher
+from .logs import log_event
+from .throttle import login_throttle
 
 router = APIRouter(prefix="/api/authentication", tags=["authentication"])
+logger = logging.getLogger(__name__)
 
 # -----------------------
 # Config & Secrets
 # -----------------------
-SECRET_KEY = config.SECRET_KEY
-ALGORITHM = config.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = config.ACCESS_TOKEN_EXPIRE_MINUTES
 REFRESH_TOKEN_EXPIRE_DAYS = config.REFRESH_TOKEN_EXPIRE_DAYS
 
 # -----------------------
 # Security & OAuth2
 # -----------------------
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/authentication/login/")
 
 # -----------------------
 # Utility Functions
 # -----------------------
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+async def verify_password(plain: str, hashed: str) -> bool:
+    return await password_hasher.verify(plain, hashed)
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return key_ring.encode(to_encode)
 
 def create_refresh_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({"exp": expire, "typ": "refresh"})
+    return key_ring.encode(to_encode)
+
+def issue_tokens(db: Session, user: models.UserProfile) -> dict:
+    # One INSERT into refresh_sessions per login; each device keeps its own session
+    jti = uuid.uuid4().hex
+    expires_delta = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    refresh_sessions.create(db, user.id, jti, datetime.utcnow() + expires_delta)
+    db.commit()
+    return {
+        "access_token": create_access_token(data={"sub": user.username}),
+        "refresh_token": create_refresh_token(data={"sub": user.username, "jti": jti}, expires_delta=expires_delta),
+        "token_type": "bearer",
+    }
 
-def get_db():
-    db = database.SessionLocal()
-    print("[DB] Connected to DB session")
+def decode_refresh_jti(token: str) -> Optional[str]:
     try:
-        yield db
-    finally:
-        db.close()
+        return key_ring.decode(token).get("jti")
+    except JWTError:
+        return None
+
+# -----------------------
+# Principal Cache
+# -----------------------
+PRINCIPAL_FIELDS = ("id", "username", "is_subscribed", "stripe_customer_id")
+
+def load_principal(db: Session, username: str):
+    # Returns a detached UserProfile; persist changes with explicit UPDATEs + invalidate_principal
+    fields = principal_cache.get(username)
+    if fields is None:
+        database.read_own_writes(db, username)
+        user = db.query(models.UserProfile).filter(models.UserProfile.username == username).first()
+        if not user:
+            return None
+        fields = {name: getattr(user, name) for name in PRINCIPAL_FIELDS}
+        principal_cache.set(username, fields)
+    return models.UserProfile(**fields)
+
+def invalidate_principal(username: str):
+    principal_cache.invalidate(username)
 
 # -----------------------
 # Protected Route Auth
 # -----------------------
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
+def get_token_subject(token: str = Depends(oauth2_scheme)) -> str:
+    # Signature and expiry only; no DB access
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate access token",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = key_ring.decode(token)
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("typ") == "refresh":
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    return username
 
-    user = db.query(models.UserProfile).filter(models.UserProfile.username == username).first()
+def get_current_user(
+    username: str = Depends(get_token_subject),
+    db: Session = Depends(database.get_db)
+):
+    user = load_principal(db, username)
     if not user:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate access token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
+def require_subscription(username: str = Depends(get_token_subject)) -> str:
+    # Served from the in-memory entitlement set; premium routes never hit the DB to check access
+    if not entitlements.store.is_entitled(username):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Active subscription required")
+    return username
+
 # -----------------------
 # Authentication Logic
 # -----------------------
-def authenticate_user(db: Session, username: str, password: str):
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else None
+
+def _find_user(db: Session, username: str):
+    database.read_own_writes(db, username)
     user = db.query(models.UserProfile).filter(models.UserProfile.username == username).first()
-    if user and verify_password(password, user.hashed_password):
-        return user
-    return None
+    database.release_connection(db)
+    return user
+
+async def authenticate_user(db: Session, username: str, password: str, client_ip: str = None):
+    # Throttle first: a rejected attempt costs no DB query and no bcrypt
+    await login_throttle.check(username, client_ip)
+    try:
+        # Sync SQLAlchemy in a worker thread, so a slow query or pool wait never blocks the event loop
+        user = await run_in_threadpool(_find_user, db, username)
+        if user is None:
+            await password_hasher.dummy_verify(password)
+            return None
+        verified = await verify_password(password, user.hashed_password)
+    except BaseException:
+        # Overload (503 from a full hash pool, pool timeouts): only judged passwords count as failures
+        await login_throttle.abandoned(username, client_ip)
+        raise
+    if not verified:
+        return None
+    await login_throttle.succeeded(username, client_ip)
+    if password_hasher.needs_update(user.hashed_password):
+        _schedule_rehash(user.id, password, user.hashed_password)
+    return user
+
+# -----------------------
+# Rehash on Login
+# -----------------------
+_rehash_tasks = set()
+
+def _store_rehash(user_id: int, old_hash: str, new_hash: str) -> bool:
+    db = database.SessionLocal()
+    try:
+        # Compare-and-set: a password change in the meantime wins
+        updated = db.execute(
+            update(models.UserProfile)
+            .where(models.UserProfile.id == user_id, models.UserProfile.hashed_password == old_hash)
+            .values(hashed_password=new_hash)
+        ).rowcount
+        db.commit()
+    finally:
+        db.close()
+    return updated == 1
+
+async def _rehash(user_id: int, password: str, old_hash: str):
+    try:
+        new_hash = await password_hasher.hash(password)
+        if await asyncio.to_thread(_store_rehash, user_id, old_hash, new_hash):
+            log_event(logger, logging.INFO, "auth.password_rehashed", user_id=user_id)
+    except Exception:
+        # Best effort; the next login tries again
+        logger.exception("auth.password_rehash_failed")
+
+def _schedule_rehash(user_id: int, password: str, old_hash: str):
+    # Runs after the login response instead of doubling its bcrypt cost
+    task = asyncio.create_task(_rehash(user_id, password, old_hash))
+    _rehash_tasks.add(task)
+    task.add_done_callback(_rehash_tasks.discard)
 
 @router.post("/login/", name="api_login_user")
-def login_user_api(
+async def login_user_api(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: Session = Depends(database.get_db),
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password, client_ip(request))
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
 
-    access_token = create_access_token(data={"sub": user.username})
-    refresh_token = create_refresh_token(data={"sub": user.username})
-
-    db_user = db.query(models.UserProfile).filter(models.UserProfile.id == user.id).first()
-    if db_user:
-        db_user.refresh_token = refresh_token
-        db.commit()
-        db.refresh(db_user)
-        print(f"[LOGIN] Saved refresh_token for {db_user.username}")
-    else:
-        print("[LOGIN] User not found in DB!")
-
-    return {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "token_type": "bearer"
-    }
+    tokens = await run_in_threadpool(issue_tokens, db, user)
+    log_event(logger, logging.INFO, "auth.login", username=user.username)
+    return tokens
 
 @router.post("/token/refresh/")
 def refresh_token_endpoint(
     refresh_token: str = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(database.get_db)
 ):
     try:
-        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = key_ring.decode(refresh_token)
         username: str = payload.get("sub")
-        if not username:
+        jti: str = payload.get("jti")
+        if not username or not jti:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        user = db.query(models.UserProfile).filter(models.UserProfile.username == username).first()
-
-        print(f"[REFRESH] DB token: {user.refresh_token if user else 'User not found'}")
-        print(f"[REFRESH] Sent token: {refresh_token}")
-
-        if not user or user.refresh_token != refresh_token:
-            print(f"[REFRESH] Token mismatch for {username}")
+        # Rotation: the presented session is consumed and replaced in one transaction
+        user_id = refresh_sessions.consume(db, jti)
+        if user_id is None:
+            db.rollback()
+            log_event(logger, logging.WARNING, "auth.refresh_rejected", username=username)
             raise HTTPException(status_code=401, detail="Token mismatch or user not found")
 
-        new_access_token = create_access_token(data={"sub": username})
-        return {"access_token": new_access_token, "token_type": "bearer"}
+        return issue_tokens(db, models.UserProfile(id=user_id, username=username))
 
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
 @router.post("/logout/")
 def logout_user(
+    refresh_token: Optional[str] = Form(None),
     current_user: models.UserProfile = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(database.get_db),
 ):
-    current_user.refresh_token = None
+    # With a refresh token only that device is logged out, otherwise every session
+    jti = decode_refresh_jti(refresh_token) if refresh_token else None
+    if jti:
+        refresh_sessions.revoke(db, jti)
+    else:
+        refresh_sessions.revoke_all(db, current_user.id)
     db.commit()
+    invalidate_principal(current_user.username)
     return {"message": "Logged out successfully"}
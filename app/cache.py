@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+from . import config
+
+# -----------------------
+# Bounded TTL/LRU Cache
+# -----------------------
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        # Sync dependencies run in Starlette's threadpool, so guard the dict
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Authenticated users keyed by JWT "sub" (username)
+principal_cache = TTLCache(
+    maxsize=config.PRINCIPAL_CACHE_MAX_SIZE,
+    ttl=config.PRINCIPAL_CACHE_TTL_SECONDS,
+)
+
+# Open Stripe checkout session URLs keyed by username; entries carry Stripe's expiry as TTL
+checkout_session_cache = TTLCache(
+    maxsize=config.CHECKOUT_CACHE_MAX_SIZE,
+    ttl=config.CHECKOUT_SESSION_TTL_SECONDS,
+)
@@ -1,5 +1,6 @@
 # app/config.py
 
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -11,6 +12,11 @@ if not SECRET_KEY:
     raise ValueError("SECRET_KEY is required in the .env file")
 
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
+# Asymmetric signing: a directory of "<kid>.pem" private keys (RSA -> RS256, EC P-256 -> ES256)
+# and optional "<kid>.pub.pem" retired public keys. Unset keeps HS256 with SECRET_KEY.
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+JWKS_MAX_AGE_SECONDS = int(os.getenv("JWKS_MAX_AGE_SECONDS", 300))
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
 
@@ -30,7 +36,123 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is required in the .env file")
 
+# Optional read replicas (comma-separated URLs); reads round-robin across them
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# Read-your-writes: after a write, that user's reads stay on the primary this long
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+
 # Stripe Webhook
 STRIPE_WEBHOOK_SECRET: str = os.getenv("STRIPE_WEBHOOK_SECRET")
 if not STRIPE_WEBHOOK_SECRET:
-    raise ValueError("STRIPE_WEBHOOK_SECRET is required in the .env file")
\ No newline at end of file
+    raise ValueError("STRIPE_WEBHOOK_SECRET is required in the .env file")
+
+# Password hashing
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))
+
+# Stripe gateway
+STRIPE_BACKEND = os.getenv("STRIPE_BACKEND", "http")  # "http" or "fake"
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "https://api.stripe.com")
+STRIPE_TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT_SECONDS", 10))
+STRIPE_READ_TIMEOUT_SECONDS = float(os.getenv("STRIPE_READ_TIMEOUT_SECONDS", 5))
+STRIPE_MAX_CONNECTIONS = int(os.getenv("STRIPE_MAX_CONNECTIONS", 20))
+STRIPE_MAX_CONCURRENCY = int(os.getenv("STRIPE_MAX_CONCURRENCY", 20))
+
+# Webhook inbox
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 200))
+WEBHOOK_POLL_INTERVAL_SECONDS = float(os.getenv("WEBHOOK_POLL_INTERVAL_SECONDS", 1))
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", 7))
+
+# Principal cache (get_current_user)
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 30))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", 10000))
+
+# DB connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Logging (JSON lines to stdout via a background writer thread)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Per-event sampling, e.g. "auth.login=0.1,auth.refresh=0.01"; unlisted events are kept
+LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (item.split("=", 1) for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if "=" in item)
+}
+LOG_RATE_LIMIT_PER_SECOND = float(os.getenv("LOG_RATE_LIMIT_PER_SECOND", 100))
+
+# Refresh session cleanup
+REFRESH_PURGE_INTERVAL_SECONDS = float(os.getenv("REFRESH_PURGE_INTERVAL_SECONDS", 3600))
+REFRESH_PURGE_BATCH_SIZE = int(os.getenv("REFRESH_PURGE_BATCH_SIZE", 1000))
+
+# Subscription entitlements (in-memory, reloaded from the DB periodically)
+ENTITLEMENT_RECONCILE_SECONDS = float(os.getenv("ENTITLEMENT_RECONCILE_SECONDS", 60))
+
+# Stripe -> DB subscription reconciliation (python -m app.reconcile, or periodic when > 0)
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", 0))
+RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", 500))
+RECONCILE_PAGE_SIZE = int(os.getenv("RECONCILE_PAGE_SIZE", 100))  # Stripe's maximum
+RECONCILE_CHECKPOINT_PATH = os.getenv("RECONCILE_CHECKPOINT_PATH", ".reconcile-checkpoint.json")
+# Stripe lookups the reconciler keeps in flight; well below STRIPE_MAX_CONCURRENCY so requests keep bulkhead room
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", 4))
+
+# Open checkout sessions are reused per user until they expire. Stripe accepts 1800-86400s and
+# expires_at is counted from the start of the minute, so allow one extra minute at the low end.
+CHECKOUT_SESSION_TTL_SECONDS = int(os.getenv("CHECKOUT_SESSION_TTL_SECONDS", 3600))
+if not 1860 <= CHECKOUT_SESSION_TTL_SECONDS <= 86400:
+    raise ValueError("CHECKOUT_SESSION_TTL_SECONDS must be between 1860 and 86400")
+# Prefixes Stripe idempotency keys, which are derived from user ids. Databases sharing a Stripe
+# account need different prefixes; the default differs per DATABASE_URL. Change it after
+# resetting a database, or reused user ids collide with keys Stripe still remembers (24h).
+STRIPE_IDEMPOTENCY_PREFIX = os.getenv(
+    "STRIPE_IDEMPOTENCY_PREFIX", hashlib.sha256(DATABASE_URL.encode("utf-8")).hexdigest()[:12]
+)
+CHECKOUT_CACHE_MAX_SIZE = int(os.getenv("CHECKOUT_CACHE_MAX_SIZE", 10000))
+
+# Stripe resilience: bulkhead, circuit breaker, retries of idempotent calls
+STRIPE_BULKHEAD_WAIT_SECONDS = float(os.getenv("STRIPE_BULKHEAD_WAIT_SECONDS", 0.5))
+STRIPE_BREAKER_ERROR_RATE = float(os.getenv("STRIPE_BREAKER_ERROR_RATE", 0.5))
+STRIPE_BREAKER_MIN_CALLS = int(os.getenv("STRIPE_BREAKER_MIN_CALLS", 10))
+STRIPE_BREAKER_WINDOW_SECONDS = float(os.getenv("STRIPE_BREAKER_WINDOW_SECONDS", 30))
+STRIPE_BREAKER_COOLDOWN_SECONDS = float(os.getenv("STRIPE_BREAKER_COOLDOWN_SECONDS", 15))
+STRIPE_RETRY_ATTEMPTS = int(os.getenv("STRIPE_RETRY_ATTEMPTS", 2))
+STRIPE_RETRY_BASE_SECONDS = float(os.getenv("STRIPE_RETRY_BASE_SECONDS", 0.2))
+STRIPE_RETRY_MAX_SECONDS = float(os.getenv("STRIPE_RETRY_MAX_SECONDS", 2))
+# Fault injection for STRIPE_BACKEND=fake
+STRIPE_FAKE_LATENCY_MS = float(os.getenv("STRIPE_FAKE_LATENCY_MS", 0))
+STRIPE_FAKE_ERROR_RATE = float(os.getenv("STRIPE_FAKE_ERROR_RATE", 0))
+
+# Login throttling (per username and per client IP); set a Redis URL to share it across workers
+LOGIN_THROTTLE_USERNAME_LIMIT = int(os.getenv("LOGIN_THROTTLE_USERNAME_LIMIT", 5))
+LOGIN_THROTTLE_USERNAME_WINDOW_SECONDS = float(os.getenv("LOGIN_THROTTLE_USERNAME_WINDOW_SECONDS", 300))
+LOGIN_THROTTLE_IP_LIMIT = int(os.getenv("LOGIN_THROTTLE_IP_LIMIT", 30))
+LOGIN_THROTTLE_IP_WINDOW_SECONDS = float(os.getenv("LOGIN_THROTTLE_IP_WINDOW_SECONDS", 60))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", 100000))
+LOGIN_THROTTLE_REDIS_URL = os.getenv("LOGIN_THROTTLE_REDIS_URL")
+
+# bcrypt cost; pick it per host with `python -m app.hashing --target-ms 250`.
+# Hashes at any other cost are rehashed in the background on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+# HTML pages: shared Jinja bytecode dir (default: a per-user temp dir) and browser/CDN cache lifetime
+JINJA_BYTECODE_DIR = os.getenv("JINJA_BYTECODE_DIR")
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "false").lower() in ("1", "true", "yes")
+PAGE_CACHE_MAX_AGE_SECONDS = int(os.getenv("PAGE_CACHE_MAX_AGE_SECONDS", 60))
+
+# Admin API (disabled unless ADMIN_TOKEN is set; send it as X-Admin-Token)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ADMIN_EXPORT_PAGE_SIZE = int(os.getenv("ADMIN_EXPORT_PAGE_SIZE", 1000))
+ADMIN_IMPORT_BATCH_SIZE = int(os.getenv("ADMIN_IMPORT_BATCH_SIZE", 500))
+ADMIN_IMPORT_MAX_USERS = int(os.getenv("ADMIN_IMPORT_MAX_USERS", 10000))
+# Bulk imports hash on a process pool, separate from the login/signup thread pool
+PASSWORD_HASH_PROCESSES = int(os.getenv("PASSWORD_HASH_PROCESSES", os.cpu_count() or 2))
+
+# Startup schema handling: "create" runs create_all and stamps the fingerprint if that built the
+# whole schema, else warns on a mismatch (dev default),
+# "check" only compares the stored fingerprint (one query), "skip" does nothing
+DB_SCHEMA_MODE = os.getenv("DB_SCHEMA_MODE", "create")
+if DB_SCHEMA_MODE not in ("create", "check", "skip"):
+    raise ValueError("DB_SCHEMA_MODE must be one of create, check, skip")
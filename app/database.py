@@ -1,30 +1,207 @@
-from sqlalchemy import create_engine
+import itertools
+import threading
+import time
+
+from fastapi import Request
+from sqlalchemy import create_engine, make_url
+from sqlalchemy import exc as sa_exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool, StaticPool
 
+from . import config
+from .cache import TTLCache
 from .config import DATABASE_URL
 
-# For SQLite, we need to pass check_same_thread=False
-connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+# -----------------------
+# Pool Telemetry
+# -----------------------
+class PoolWaitStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+class _WaitTimingMixin:
+    # Times how long callers block waiting for a pooled connection
+    wait_stats: PoolWaitStats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except sa_exc.TimeoutError:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return conn
+
+
+def _timed_pool(base):
+    return type(f"Timed{base.__name__}", (_WaitTimingMixin, base), {"wait_stats": PoolWaitStats()})
+
 
+def _engine_kwargs(url: str, pool_base) -> dict:
+    if url.startswith("sqlite"):
+        # For SQLite, we need to pass check_same_thread=False; there is no "info" schema either
+        kwargs = {
+            "connect_args": {"check_same_thread": False},
+            "execution_options": {"schema_translate_map": {"info": None}},
+        }
+        if make_url(url).database in (None, "", ":memory:"):
+            kwargs["poolclass"] = StaticPool
+            return kwargs
+    else:
+        kwargs = {}
+    kwargs.update(
+        poolclass=_timed_pool(pool_base),
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+    )
+    return kwargs
+
+
+def pool_status(engine_) -> dict:
+    pool = engine_.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+            # Per process: multiply by the uvicorn worker count for the DB-side total
+            max_connections=pool.size() + pool._max_overflow,
+            timeout_seconds=pool.timeout(),
+        )
+    stats = getattr(pool, "wait_stats", None)
+    if stats is not None:
+        status.update(
+            checkouts=stats.checkouts,
+            checkout_timeouts=stats.timeouts,
+            wait_seconds_total=round(stats.wait_seconds_total, 6),
+            wait_seconds_max=round(stats.wait_seconds_max, 6),
+        )
+    return status
+
+# -----------------------
+# Sync Engine (+ read replicas)
+# -----------------------
 # Create the SQLAlchemy engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args=connect_args,
-)
+engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL, QueuePool))
+
+replica_engines = [
+    create_engine(url, **_engine_kwargs(url, QueuePool)) for url in config.DATABASE_REPLICA_URLS
+]
+_replica_cycle = itertools.cycle(replica_engines)
+_replica_lock = threading.Lock()
+
+# Usernames written recently by this process; their reads stay on the primary
+_recent_writes = TTLCache(maxsize=100_000, ttl=config.REPLICA_STICKY_SECONDS)
+
+
+class RoutingSession(Session):
+    # Plain SELECTs go to one round-robin replica per session; writes, flushes,
+    # SELECT ... FOR UPDATE and anything after the session's first write use the primary.
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not replica_engines or self.info.get("primary"):
+            return engine
+        is_plain_select = (
+            clause is not None
+            and getattr(clause, "is_select", False)
+            and getattr(clause, "_for_update_arg", None) is None
+        )
+        if self._flushing or not is_plain_select:
+            self.info["primary"] = True
+            return engine
+        if "replica" not in self.info:
+            with _replica_lock:
+                self.info["replica"] = next(_replica_cycle)
+        return self.info["replica"]
+
+
+def use_primary(db: Session):
+    """Route all further reads of this session to the primary."""
+    db.info["primary"] = True
+
+
+def mark_written(username: str):
+    if replica_engines:
+        _recent_writes.set(username, True)
+
+
+def read_own_writes(db: Session, username: str):
+    if replica_engines and _recent_writes.get(username):
+        use_primary(db)
+
+
+def release_connection(db: Session):
+    # Ends the read transaction so the pooled connection isn't held while the
+    # request awaits bcrypt or Stripe; loaded objects stay usable (expire_on_commit=False).
+    db.commit()
+
 
 # Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
 
 # Base class for our ORM models
 Base = declarative_base()
 
 # ✅ Dependency for FastAPI route handlers
-def get_db():
+# One session per request: FastAPI caches dependencies within a request, so
+# get_current_user and the route itself share this session (and its connection).
+# Clients can send "X-Read-Primary: 1" to bypass replicas for the whole request.
+def get_db(request: Request):
     db: Session = SessionLocal()
+    if request.headers.get("x-read-primary"):
+        use_primary(db)
     try:
         yield db
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
+
+def pool_statistics() -> dict:
+    stats = {"sync": pool_status(engine)}
+    for index, replica in enumerate(replica_engines):
+        stats[f"replica_{index}"] = pool_status(replica)
+    return stats
+
+def _dialect_insert(table):
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"ON CONFLICT is not supported on {engine.dialect.name}")
+    return dialect_insert(table)
+
+# Dialect-aware "INSERT ... ON CONFLICT DO NOTHING"
+def insert_ignore(table):
+    return _dialect_insert(table).on_conflict_do_nothing()
+
+# Dialect-aware "INSERT ... ON CONFLICT (key) DO UPDATE" of every non-key column
+def upsert(table, values: dict, index_elements: list):
+    stmt = _dialect_insert(table).values(**values)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={name: stmt.excluded[name] for name in values if name not in index_elements},
+    )
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from . import config, database, models
+
+logger = logging.getLogger(__name__)
+
+# Stripe subscription statuses that grant access; the webhook worker and the reconciler both use this
+ENTITLED_STATUSES = ("active", "trialing")
+
+# -----------------------
+# Entitlement Store
+# -----------------------
+class EntitlementStore:
+    """Usernames with an active subscription, held in memory.
+
+    Warmed at startup, kept current by the webhook worker and payment
+    success, and fully reloaded every ``reconcile_interval`` seconds so
+    changes applied by other workers converge.
+    """
+
+    def __init__(self, session_factory, reconcile_interval: float):
+        self.session_factory = session_factory
+        self.reconcile_interval = reconcile_interval
+        self.last_loaded_at = None
+        self.reloads = 0
+        self._subscribed = frozenset()
+        self._lock = threading.Lock()
+        self._changes_during_load = None
+        self._task = None
+
+    def is_entitled(self, username: str) -> bool:
+        return username in self._subscribed
+
+    def set(self, username: str, subscribed: bool):
+        with self._lock:
+            if subscribed:
+                self._subscribed = self._subscribed | {username}
+            else:
+                self._subscribed = self._subscribed - {username}
+            if self._changes_during_load is not None:
+                self._changes_during_load[username] = subscribed
+
+    def load(self):
+        with self._lock:
+            self._changes_during_load = {}
+        try:
+            db = self.session_factory()
+            try:
+                usernames = (
+                    db.query(models.UserProfile.username)
+                    .filter(models.UserProfile.is_subscribed.is_(True))
+                    .all()
+                )
+            finally:
+                db.close()
+            with self._lock:
+                fresh = {username for (username,) in usernames}
+                # Replay updates that landed while the snapshot query was running
+                for username, subscribed in self._changes_during_load.items():
+                    if subscribed:
+                        fresh.add(username)
+                    else:
+                        fresh.discard(username)
+                self._subscribed = frozenset(fresh)
+        finally:
+            with self._lock:
+                self._changes_during_load = None
+        self.last_loaded_at = datetime.utcnow()
+        self.reloads += 1
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception:
+                logger.exception("entitlements.reload_failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "entitled_users": len(self._subscribed),
+            "reloads": self.reloads,
+            "last_loaded_at": self.last_loaded_at.isoformat() if self.last_loaded_at else None,
+        }
+
+
+store = EntitlementStore(
+    session_factory=database.SessionLocal,
+    reconcile_interval=config.ENTITLEMENT_RECONCILE_SECONDS,
+)
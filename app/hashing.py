@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from . import config, metrics
+
+# -----------------------
+# Password Hashing Service
+# -----------------------
+# min == max == default, so needs_update() flags hashes made at any other cost, up or down
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=config.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=config.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=config.BCRYPT_ROUNDS,
+)
+
+
+def hash_batch(passwords: list) -> list:
+    # Module-level so it can be pickled to ProcessPoolExecutor workers
+    return [pwd_context.hash(password) for password in passwords]
+
+
+class PasswordHasher:
+    """bcrypt on its own bounded thread pool, off the event loop.
+
+    bcrypt releases the GIL, so threads hash in parallel without taking
+    slots from Starlette's shared threadpool. Once ``max_queue`` jobs are
+    in flight, new ones are rejected with 503 rather than queued.
+    """
+
+    def __init__(self, workers: int, max_queue: int, processes: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.processes = processes
+        self._process_pool = None
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = None
+        self._dummy_hash = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="pwd-hash"
+            )
+        return self._executor
+
+    async def _submit(self, operation: str, fn, *args):
+        if self.in_flight >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication service busy, retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            metrics.observe_password_hash(operation, time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        return await self._submit("hash", pwd_context.hash, password)
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        return await self._submit("verify", pwd_context.verify, plain, hashed)
+
+    def needs_update(self, hashed: str) -> bool:
+        # Parses the hash prefix only; no bcrypt work
+        return pwd_context.needs_update(hashed)
+
+    async def dummy_verify(self, plain: str) -> bool:
+        # Same cost as a real verify, so unknown usernames can't be told apart by timing
+        if self._dummy_hash is None:
+            self._dummy_hash = await self.hash("dummy-password-for-unknown-users")
+        await self.verify(plain, self._dummy_hash)
+        return False
+
+    async def hash_many(self, passwords: list) -> list:
+        """Bulk hashing (admin import) on a process pool, so it never queues behind logins."""
+        if not passwords:
+            return []
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.processes)
+        size = -(-len(passwords) // self.processes)
+        chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        hashed = await asyncio.gather(*(loop.run_in_executor(self._process_pool, hash_batch, chunk) for chunk in chunks))
+        metrics.observe_password_hash("hash_many", time.perf_counter() - start)
+        return [value for chunk in hashed for value in chunk]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+
+password_hasher = PasswordHasher(
+    workers=config.PASSWORD_HASH_WORKERS,
+    max_queue=config.PASSWORD_HASH_MAX_QUEUE,
+    processes=config.PASSWORD_HASH_PROCESSES,
+)
+
+# -----------------------
+# Cost Calibration CLI
+# -----------------------
+def calibrate(target_ms: float, min_rounds: int = 10, max_rounds: int = 16, samples: int = 3) -> list:
+    """Times bcrypt at each cost on this host; returns [(rounds, median_ms)]."""
+    timings = []
+    for rounds in range(min_rounds, max_rounds + 1):
+        context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+        durations = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            context.hash("calibration-password")
+            durations.append((time.perf_counter() - start) * 1000)
+        timings.append((rounds, statistics.median(durations)))
+        if timings[-1][1] > target_ms:
+            break  # each extra round doubles the cost; no point timing beyond the budget
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick BCRYPT_ROUNDS for a per-hash latency budget on this host")
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    args = parser.parse_args()
+
+    timings = calibrate(args.target_ms, args.min_rounds, args.max_rounds)
+    for rounds, ms in timings:
+        print(f"rounds={rounds:<3} {ms:8.1f} ms")
+    fitting = [rounds for rounds, ms in timings if ms <= args.target_ms]
+    if not fitting:
+        print(f"No cost fits {args.target_ms} ms on this host; using the floor")
+    print(f"BCRYPT_ROUNDS={fitting[-1] if fitting else args.min_rounds}")
@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+from fastapi import APIRouter, Request, Response
+from jose import JWTError, jwk, jwt
+
+from . import config
+
+router = APIRouter()
+
+# -----------------------
+# Key Ring
+# -----------------------
+@dataclass
+class SigningKey:
+    kid: str
+    algorithm: str
+    signing_key: object  # PEM/secret used by jwt.encode; None for verify-only keys
+    verify_key: object
+    public_jwk: dict = None
+
+
+def _algorithm_for(pem: bytes) -> str:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    try:
+        key = serialization.load_pem_private_key(pem, password=None)
+    except (TypeError, ValueError):
+        key = serialization.load_pem_public_key(pem)
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return "RS256"
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return {"secp256r1": "ES256", "secp384r1": "ES384", "secp521r1": "ES512"}[key.curve.name]
+    raise ValueError(f"Unsupported JWT key type {type(key).__name__} (python-jose has no EdDSA)")
+
+
+def _asymmetric_key(kid: str, pem: bytes, private: bool) -> SigningKey:
+    algorithm = _algorithm_for(pem)
+    key = jwk.construct(pem.decode(), algorithm)
+    public = key.public_key() if private else key
+    public_jwk = {**public.to_dict(), "kid": kid, "use": "sig", "alg": algorithm}
+    return SigningKey(
+        kid=kid,
+        algorithm=algorithm,
+        signing_key=pem.decode() if private else None,
+        verify_key=public.to_pem().decode(),
+        public_jwk=public_jwk,
+    )
+
+
+class KeyRing:
+    """Signs with the active key; verifies with any key whose kid is on the ring."""
+
+    def __init__(self, keys: list, active_kid: str):
+        self.keys = {key.kid: key for key in keys}
+        if active_kid not in self.keys or self.keys[active_kid].signing_key is None:
+            raise ValueError(f"JWT_ACTIVE_KID '{active_kid}' has no private key")
+        self.active = self.keys[active_kid]
+        self.jwks = {"keys": [key.public_jwk for key in keys if key.public_jwk]}
+        self.jwks_body = json.dumps(self.jwks, separators=(",", ":")).encode()
+        self.jwks_etag = '"' + hashlib.sha256(self.jwks_body).hexdigest()[:32] + '"'
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(
+            claims, self.active.signing_key, algorithm=self.active.algorithm,
+            headers={"kid": self.active.kid},
+        )
+
+    def decode(self, token: str) -> dict:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.keys.get(kid) if kid else None
+        if key is None:
+            # Tokens minted before kids existed fall back to the active key
+            if kid is not None:
+                raise JWTError(f"Unknown key id {kid!r}")
+            key = self.active
+        return jwt.decode(token, key.verify_key, algorithms=[key.algorithm])
+
+    @classmethod
+    def from_directory(cls, path: str, active_kid: str) -> "KeyRing":
+        keys = []
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".pem"):
+                continue
+            with open(os.path.join(path, name), "rb") as fh:
+                pem = fh.read()
+            if name.endswith(".pub.pem"):
+                keys.append(_asymmetric_key(name[: -len(".pub.pem")], pem, private=False))
+            else:
+                keys.append(_asymmetric_key(name[: -len(".pem")], pem, private=True))
+        if not keys:
+            raise ValueError(f"No .pem keys found in JWT_KEYS_DIR={path}")
+        return cls(keys, active_kid or keys[-1].kid)
+
+    @classmethod
+    def from_config(cls) -> "KeyRing":
+        if config.JWT_KEYS_DIR:
+            return cls.from_directory(config.JWT_KEYS_DIR, config.JWT_ACTIVE_KID)
+        # Shared-secret mode: nothing to publish, behaves like the original HS256 setup
+        secret = SigningKey(
+            kid=config.JWT_ACTIVE_KID or "default",
+            algorithm=config.ALGORITHM,
+            signing_key=config.SECRET_KEY,
+            verify_key=config.SECRET_KEY,
+        )
+        return cls([secret], secret.kid)
+
+
+key_ring = KeyRing.from_config()
+
+# -----------------------
+# JWKS Endpoint
+# -----------------------
+@router.get("/.well-known/jwks.json", include_in_schema=False)
+def jwks(request: Request):
+    headers = {
+        "Cache-Control": f"public, max-age={config.JWKS_MAX_AGE_SECONDS}",
+        "ETag": key_ring.jwks_etag,
+    }
+    if request.headers.get("if-none-match") == key_ring.jwks_etag:
+        return Response(status_code=304, headers=headers)
+    return Response(key_ring.jwks_body, media_type="application/json", headers=headers)
+
+# -----------------------
+# Key Generation CLI
+# -----------------------
+def generate_key(directory: str, kid: str, algorithm: str) -> str:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == "ES256":
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        raise ValueError(f"Unsupported algorithm {algorithm}")
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{kid}.pem")
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as fh:
+        fh.write(
+            private_key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a JWT signing key for JWT_KEYS_DIR")
+    parser.add_argument("kid", help="key id, e.g. 2026-10")
+    parser.add_argument("--dir", default=config.JWT_KEYS_DIR or "keys")
+    parser.add_argument("--alg", choices=("RS256", "ES256"), default="RS256")
+    args = parser.parse_args()
+    print(generate_key(args.dir, args.kid, args.alg))
@@ -0,0 +1,157 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from . import config
+
+# Never let credentials reach the log stream, whatever the caller passes
+REDACTED = "[REDACTED]"
+_SENSITIVE_KEY = re.compile(r"token|password|secret|authorization|cookie|signature", re.IGNORECASE)
+
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if _SENSITIVE_KEY.search(str(key)) else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """Log a structured event; the message is the event name used for sampling."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+# -----------------------
+# Formatting
+# -----------------------
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(redact(getattr(record, "fields", None) or {}))
+        extras = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS and key != "fields"}
+        if extras:
+            entry.update(redact(extras))
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+# -----------------------
+# Sampling & Rate Limits
+# -----------------------
+class SamplingFilter(logging.Filter):
+    """Drops records per event name: random sampling, then a per-second token bucket."""
+
+    def __init__(self, sample_rates: dict, rate_per_second: float):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate = rate_per_second
+        self.dropped = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = record.msg if isinstance(record.msg, str) else str(record.msg)
+        rate = self.sample_rates.get(event)
+        if rate is not None and random.random() >= rate:
+            self.dropped += 1
+            return False
+        if self.rate <= 0:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(event, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[event] = (tokens, now)
+                self.dropped += 1
+                return False
+            self._buckets[event] = (tokens - 1, now)
+        return True
+
+# -----------------------
+# Queue Handler (non-blocking)
+# -----------------------
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Defer JSON formatting to the writer thread; only resolve args and tracebacks here
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: logging.handlers.QueueListener = None
+_handler: DroppingQueueHandler = None
+_filter: SamplingFilter = None
+
+
+def setup_logging():
+    global _listener, _handler, _filter
+    if _listener is not None:
+        return
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+
+    _filter = SamplingFilter(config.LOG_SAMPLE_RATES, config.LOG_RATE_LIMIT_PER_SECOND)
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_SIZE))
+    _handler.addFilter(_filter)
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(config.LOG_LEVEL)
+    app_logger.addHandler(_handler)
+    app_logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(_handler.queue, writer, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()  # flushes what is already queued
+        logging.getLogger("app").removeHandler(_handler)
+        _listener = None
+        _handler = None
+
+
+def logging_stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped_queue_full": _handler.dropped if _handler else 0,
+        "dropped_sampled_or_rate_limited": _filter.dropped if _filter else 0,
+    }
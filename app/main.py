@@ -1,13 +1,17 @@
-from fastapi import FastAPI, Request, Form, Depends
+import asyncio
+import logging
+
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request, Form, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy.orm import Session
 
-from . import models, database, users, payments, auth
+from . import database, users, payments, admin, auth, entitlements, hashing, keys, logs, metrics, ops, pages, reconcile, refresh_sessions, schema, startup, webhook_inbox
+from .stripe_gateway import close_stripe_gateway
 
-import os
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Auth & Subscription API",
@@ -29,20 +33,45 @@ app.add_middleware(
 
 app.add_middleware(SessionMiddleware, secret_key="your_session_secret_here")
 
-# -----------------------
-# Jinja2 Templates
-# -----------------------
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+# Outermost, so latency covers the other middleware too
+app.add_middleware(metrics.MetricsMiddleware)
 
 # -----------------------
 # Database Initialization
 # -----------------------
 
+_template_warmup = None
+
+
 @app.on_event("startup")
-def on_startup():
-    models.Base.metadata.create_all(bind=database.engine)
+async def on_startup():
+    with startup.timer.phase("logging"):
+        logs.setup_logging()
+    with startup.timer.phase("schema"):
+        await asyncio.to_thread(schema.prepare)  # DB_SCHEMA_MODE=check: one SELECT, not create_all
+    with startup.timer.phase("entitlements"):
+        await asyncio.to_thread(entitlements.store.load)  # warm before serving
+    # Templates compile in the background; the first page render compiles on demand if it wins the race
+    global _template_warmup
+    _template_warmup = asyncio.create_task(asyncio.to_thread(pages.warm_templates))
+    entitlements.store.start()
+    webhook_inbox.worker.start()
+    refresh_sessions.purger.start()
+    reconcile.scheduler.start()
+    startup.timer.ready()
+    logs.log_event(logger, logging.INFO, "startup.ready", **startup.timer.report())
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await webhook_inbox.worker.stop()
+    await refresh_sessions.purger.stop()
+    await entitlements.store.stop()
+    await reconcile.scheduler.stop()
+    hashing.password_hasher.shutdown()
+    await close_stripe_gateway()
+    metrics.mark_process_dead()
+    logs.shutdown_logging()
 
 # -----------------------
 # API Routers
@@ -51,6 +80,10 @@ def on_startup():
 app.include_router(users.router)
 app.include_router(payments.router)
 app.include_router(auth.router)
+app.include_router(ops.router)
+app.include_router(metrics.router)
+app.include_router(keys.router)
+app.include_router(admin.router)
 
 # -----------------------
 # HTML Frontend Routes
@@ -58,66 +91,65 @@ app.include_router(auth.router)
 
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return pages.static_page(request, "index.html")
 
 
 @app.get("/signup", response_class=HTMLResponse)
 def signup_form(request: Request):
-    return templates.TemplateResponse("signup.html", {"request": request})
+    return pages.static_page(request, "signup.html")
 
 
 @app.post("/signup")
-def signup_user(
+async def signup_user(
     request: Request,
+    background_tasks: BackgroundTasks,
     username: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(database.get_db),
 ):
-    existing_user = db.query(models.UserProfile).filter_by(username=username).first()
-    if existing_user:
-        return templates.TemplateResponse("signup.html", {
+    hashed = await auth.get_password_hash(password)
+    user = await run_in_threadpool(users.create_user, db, username, hashed)
+    if user is None:
+        return pages.render("signup.html", {
             "request": request,
             "error": "Username already exists."
         })
-
-    hashed = auth.get_password_hash(password)
-    user = models.UserProfile(username=username, hashed_password=hashed)
-    db.add(user)
-    db.commit()
+    background_tasks.add_task(payments.provision_customer, user.id, username)
     return RedirectResponse("/login", status_code=302)
 
 
 @app.get("/login", response_class=HTMLResponse)
 def login_form(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return pages.static_page(request, "login.html")
 
 
 @app.post("/login")
-def login_user(
+async def login_user(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(database.get_db),
 ):
-    user = db.query(models.UserProfile).filter_by(username=username).first()
-    if not user or not auth.verify_password(password, user.hashed_password):
-        return templates.TemplateResponse("login.html", {
+    try:
+        user = await auth.authenticate_user(db, username, password, auth.client_ip(request))
+    except HTTPException as e:
+        if e.status_code != 429:
+            raise
+        return pages.render("login.html", {
+            "request": request,
+            "error": "Too many login attempts, try again later."
+        }, status_code=429, headers=e.headers)
+    if not user:
+        return pages.render("login.html", {
             "request": request,
             "error": "Invalid credentials"
         })
 
-    access_token = auth.create_access_token(data={"sub": user.username})
-    refresh_token = auth.create_refresh_token(data={"sub": user.username})
-
-    # ✅ FIX: Reattach the user object to the session before commit
-    user.refresh_token = refresh_token
-    db.add(user)               # ✅ REQUIRED
-    db.commit()
-    db.refresh(user)           # optional but helpful
+    tokens = await run_in_threadpool(auth.issue_tokens, db, user)
 
     response = RedirectResponse("/profile", status_code=302)
-    response.set_cookie("access_token", access_token, httponly=False, samesite="Lax")
-    response.set_cookie("refresh_token", refresh_token, httponly=True, samesite="Lax")
+    response.set_cookie("access_token", tokens["access_token"], httponly=False, samesite="Lax")
+    response.set_cookie("refresh_token", tokens["refresh_token"], httponly=True, samesite="Lax")
 
     request.session["user"] = user.username
     return response
@@ -130,11 +162,11 @@ def view_profile(request: Request, db: Session = Depends(database.get_db)):
     if not username:
         return RedirectResponse("/login", status_code=302)
 
-    user = db.query(models.UserProfile).filter_by(username=username).first()
+    user = auth.load_principal(db, username)
     if not user:
         return RedirectResponse("/login", status_code=302)
 
-    return templates.TemplateResponse("profile.html", {"request": request, "user": user})
+    return pages.render("profile.html", {"request": request, "user": user})
 
 
 @app.get("/logout")
@@ -144,11 +176,12 @@ def logout(
 ):
     username = request.session.get("user")
     if username:
-        # Clear refresh token from database
-        user = db.query(models.UserProfile).filter_by(username=username).first()
-        if user:
-            user.refresh_token = None
+        # Revoke this browser's refresh session
+        jti = auth.decode_refresh_jti(request.cookies.get("refresh_token", ""))
+        if jti:
+            refresh_sessions.revoke(db, jti)
             db.commit()
+        auth.invalidate_principal(username)
 
     # Clear session and cookies
     request.session.clear()
@@ -159,9 +192,12 @@ def logout(
 
 @app.get("/success", response_class=HTMLResponse)
 def success(request: Request):
-    return templates.TemplateResponse("success.html", {"request": request})
+    return pages.static_page(request, "success.html")
 
 
 @app.get("/cancel", response_class=HTMLResponse)
 def cancel(request: Request):
-    return templates.TemplateResponse("cancel.html", {"request": request})
+    return pages.static_page(request, "cancel.html")
+
+
+startup.timer.mark("import")
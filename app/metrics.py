@@ -0,0 +1,184 @@
+import os
+import time
+from contextvars import ContextVar
+
+from fastapi import APIRouter, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to a shared, empty
+# directory; each worker then writes its samples there and /metrics aggregates them.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+router = APIRouter()
+
+# -----------------------
+# Metric Definitions
+# -----------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "End-to-end request latency", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "DB queries issued per request", ["route"],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in DB queries per request", ["route"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_STRIPE_SECONDS = Histogram(
+    "http_request_stripe_seconds", "Time spent waiting on Stripe per request", ["route"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_PASSWORD_HASH_SECONDS = Histogram(
+    "http_request_password_hash_seconds", "Time spent in bcrypt per request", ["route"], buckets=LATENCY_BUCKETS,
+)
+STRIPE_CALLS = Counter("stripe_calls_total", "Stripe API calls", ["operation", "outcome"])
+STRIPE_LATENCY = Histogram(
+    "stripe_call_duration_seconds", "Stripe API call latency", ["operation"], buckets=LATENCY_BUCKETS,
+)
+STRIPE_REJECTED = Counter(
+    "stripe_calls_rejected_total", "Stripe calls failed fast without reaching Stripe", ["operation", "reason"],
+)
+STRIPE_RETRIES = Counter("stripe_call_retries_total", "Stripe call retries after a transient error", ["operation"])
+STRIPE_BREAKER_STATE = Gauge(
+    "stripe_circuit_breaker_state", "Stripe circuit breaker: 0 closed, 1 half-open, 2 open",
+    multiprocess_mode="livemax",
+)
+PASSWORD_HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify latency incl. pool wait", ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES = Counter("db_queries_total", "DB queries executed (all sources)")
+
+# -----------------------
+# Per-request Accumulators
+# -----------------------
+class RequestStats:
+    __slots__ = ("db_queries", "db_seconds", "stripe_seconds", "hash_seconds")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.stripe_seconds = 0.0
+        self.hash_seconds = 0.0
+
+
+# Context vars are copied into Starlette's threadpool, so sync dependencies
+# and routes add to the same RequestStats object as the async code around them.
+_request_stats: ContextVar[RequestStats] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> RequestStats:
+    return _request_stats.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERIES.inc()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_seconds += elapsed
+
+
+def observe_stripe_call(operation: str, seconds: float, ok: bool):
+    STRIPE_CALLS.labels(operation, "ok" if ok else "error").inc()
+    STRIPE_LATENCY.labels(operation).observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.stripe_seconds += seconds
+
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def set_stripe_breaker_state(state: str):
+    STRIPE_BREAKER_STATE.set(BREAKER_STATES[state])
+
+
+def observe_stripe_rejected(operation: str, reason: str):
+    STRIPE_REJECTED.labels(operation, reason).inc()
+
+
+def observe_stripe_retry(operation: str):
+    STRIPE_RETRIES.labels(operation).inc()
+
+
+def observe_password_hash(operation: str, seconds: float):
+    PASSWORD_HASH_LATENCY.labels(operation).observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.hash_seconds += seconds
+
+# -----------------------
+# ASGI Middleware
+# -----------------------
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            # Route templates keep label cardinality bounded; unknown paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, str(status_code)).observe(elapsed)
+            REQUEST_DB_QUERIES.labels(route).observe(stats.db_queries)
+            REQUEST_DB_SECONDS.labels(route).observe(stats.db_seconds)
+            if stats.stripe_seconds:
+                REQUEST_STRIPE_SECONDS.labels(route).observe(stats.stripe_seconds)
+            if stats.hash_seconds:
+                REQUEST_PASSWORD_HASH_SECONDS.labels(route).observe(stats.hash_seconds)
+
+# -----------------------
+# Exposition
+# -----------------------
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead():
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
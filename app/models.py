@@ -1,4 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String
+from datetime import datetime
+
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Text
 from .database import Base
 
 class UserProfile(Base):
@@ -10,7 +12,8 @@ class UserProfile(Base):
     hashed_password = Column(String, nullable=False)
     is_subscribed = Column(Boolean, default=False, nullable=False)
     stripe_customer_id = Column(String, unique=True, nullable=True)
-    refresh_token = Column(String, nullable=True)
+    # Stripe `created` of the newest webhook event applied to is_subscribed; older ones are ignored
+    subscription_event_created = Column(Integer, nullable=True)
 
     def __repr__(self):
         return (
@@ -18,3 +21,55 @@ class UserProfile(Base):
             f"subscribed={self.is_subscribed}, "
             f"stripe_customer_id={self.stripe_customer_id})>"
         )
+
+
+class WebhookEvent(Base):
+    __tablename__ = "webhook_events"
+    __table_args__ = (
+        Index("ix_webhook_events_pending", "processed_at", "created"),
+        {"schema": "info"},
+    )
+
+    event_id = Column(String, primary_key=True)  # Stripe event id, dedupes retries
+    type = Column(String, nullable=False)
+    customer_id = Column(String, nullable=True, index=True)
+    object_id = Column(String, nullable=True, index=True)
+    created = Column(Integer, nullable=False)  # Stripe event timestamp (epoch seconds)
+    payload = Column(Text, nullable=False)
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<WebhookEvent(event_id='{self.event_id}', type='{self.type}')>"
+
+
+class RefreshSession(Base):
+    __tablename__ = "refresh_sessions"
+    __table_args__ = (
+        Index("ix_refresh_sessions_user_expiry", "user_id", "expires_at"),
+        Index("ix_refresh_sessions_expires_at", "expires_at"),
+        {"schema": "info"},
+    )
+
+    jti_hash = Column(String(64), primary_key=True)  # sha256 of the token's jti, never the token
+    user_id = Column(
+        Integer, ForeignKey("info.user_profiles.id", ondelete="CASCADE"), nullable=False
+    )
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<RefreshSession(user_id={self.user_id}, expires_at={self.expires_at})>"
+
+
+class SchemaFingerprint(Base):
+    # Single row written by `python -m app.schema stamp` (or DB_SCHEMA_MODE=create)
+    __tablename__ = "schema_fingerprint"
+    __table_args__ = {"schema": "info"}
+
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    stamped_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SchemaFingerprint(fingerprint='{self.fingerprint}')>"
@@ -0,0 +1,74 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from . import admin, config, database, entitlements, logs, reconcile, startup, webhook_inbox
+from .cache import checkout_session_cache, principal_cache
+from .stripe_gateway import get_stripe_gateway
+
+# Operational stats expose Stripe ids and cost queries per hit; same X-Admin-Token guard as the admin API
+router = APIRouter(prefix="/internal", tags=["internal"], dependencies=[Depends(admin.require_admin)])
+
+# ----------------------------------------
+# Webhook Inbox
+# ----------------------------------------
+@router.get("/webhook-inbox/")
+def webhook_inbox_stats(db: Session = Depends(database.get_db)):
+    return webhook_inbox.worker.stats(db)
+
+# ----------------------------------------
+# Principal Cache
+# ----------------------------------------
+@router.get("/principal-cache/")
+def principal_cache_stats():
+    return principal_cache.stats()
+
+
+@router.get("/checkout-cache/")
+def checkout_cache_stats():
+    return checkout_session_cache.stats()
+
+# ----------------------------------------
+# Subscription Entitlements
+# ----------------------------------------
+@router.get("/entitlements/")
+def entitlement_stats():
+    return entitlements.store.stats()
+
+# ----------------------------------------
+# Stripe Reconciliation
+# ----------------------------------------
+@router.get("/reconcile/")
+def reconcile_stats():
+    return {
+        "interval_seconds": reconcile.scheduler.interval,
+        "checkpoint": reconcile.load_checkpoint(config.RECONCILE_CHECKPOINT_PATH),
+        "last_result": reconcile.scheduler.last_result,
+    }
+
+# ----------------------------------------
+# Stripe Gateway
+# ----------------------------------------
+@router.get("/stripe/")
+async def stripe_gateway_stats():
+    return (await get_stripe_gateway()).stats()
+
+# ----------------------------------------
+# DB Connection Pool
+# ----------------------------------------
+@router.get("/db-pool/")
+def db_pool_stats():
+    return database.pool_statistics()
+
+# ----------------------------------------
+# Logging
+# ----------------------------------------
+@router.get("/logging/")
+def logging_stats():
+    return logs.logging_stats()
+
+# ----------------------------------------
+# Startup
+# ----------------------------------------
+@router.get("/startup/")
+def startup_stats():
+    return {"schema_mode": config.DB_SCHEMA_MODE, **startup.timer.report()}
@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+import os
+
+from fastapi import Request, Response
+
+from . import config
+
+try:
+    import brotli  # optional; without it only gzip variants are served
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_templates = None
+
+# Pages whose output does not depend on the request; rendered once per process
+STATIC_PAGES = ("index.html", "signup.html", "login.html", "success.html", "cancel.html")
+
+# -----------------------
+# Templates
+# -----------------------
+def get_templates():
+    # Jinja is imported on first use, so it stays off the import path of workers and CLIs
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        from jinja2 import FileSystemBytecodeCache
+
+        templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+        # Compiled templates are shared on disk, so new workers skip Jinja's parse/compile step
+        templates.env.bytecode_cache = FileSystemBytecodeCache(config.JINJA_BYTECODE_DIR)
+        templates.env.auto_reload = config.TEMPLATES_AUTO_RELOAD
+        _templates = templates
+    return _templates
+
+
+def render(name: str, context: dict, **kwargs) -> Response:
+    return get_templates().TemplateResponse(name, context, **kwargs)
+
+# -----------------------
+# Rendered Page Cache
+# -----------------------
+class RenderedPage:
+    def __init__(self, body: bytes):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # Strong ETags are per representation, so every encoding gets its own
+        self.variants = {"identity": (body, f'"{digest}"')}
+        self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+
+    def negotiate(self, accept_encoding: str) -> str:
+        accepted = set()
+        for part in accept_encoding.split(","):
+            encoding, *params = [piece.strip() for piece in part.split(";")]
+            if _qvalue(params) > 0:
+                accepted.add(encoding.lower())
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return encoding
+        return "identity"
+
+
+def _qvalue(params: list) -> float:
+    # "q=0", "q=0.0", "Q = 0.000" all opt out; a malformed q-value counts as not accepted
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+_rendered = {}
+
+
+def warm_templates():
+    # Compile every template (filling the bytecode cache) and pre-render the static pages
+    env = get_templates().env
+    for name in env.list_templates():
+        env.get_template(name)
+    for name in STATIC_PAGES:
+        _render(name)
+
+
+def _render(name: str) -> RenderedPage:
+    page = _rendered.get(name)
+    if page is None:
+        page = _rendered[name] = RenderedPage(get_templates().env.get_template(name).render().encode("utf-8"))
+    return page
+
+
+def static_page(request: Request, name: str) -> Response:
+    page = _render(name)
+    encoding = page.negotiate(request.headers.get("accept-encoding", ""))
+    body, etag = page.variants[encoding]
+
+    # Signed-in browsers carry a session cookie that may be re-set on the response; keep those out of shared caches
+    scope = "private" if request.session else "public"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"{scope}, max-age={config.PAGE_CACHE_MAX_AGE_SECONDS}",
+        "Vary": "Accept-Encoding",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="text/html; charset=utf-8", headers=headers)
@@ -1,13 +1,69 @@
-from fastapi import Request, APIRouter, Depends, HTTPException
+import asyncio
+import logging
+import math
+import time
+from fastapi import Request, APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-import stripe
-from . import auth, models, config
+from . import auth, models, config, database, webhook_inbox
+from .cache import checkout_session_cache
+from .logs import log_event
+from .stripe_gateway import StripeGateway, StripeGatewayError, StripeUnavailableError, get_stripe_gateway
 
 router = APIRouter(prefix="/api/payment", tags=["payment"])
+logger = logging.getLogger(__name__)
 
-stripe.api_key = config.STRIPE_API_KEY
 PRICE_ID = config.STRIPE_PRICE_ID
 DOMAIN = config.DOMAIN
+CHECKOUT_STATUS_MAX_WAIT_SECONDS = 25
+CHECKOUT_STATUS_POLL_SECONDS = 0.5
+CHECKOUT_SESSION_TTL_SECONDS = config.CHECKOUT_SESSION_TTL_SECONDS
+
+def idempotency_key(*parts) -> str:
+    # Scoped per environment: user ids alone repeat across databases sharing a Stripe account
+    return "-".join(str(part) for part in (config.STRIPE_IDEMPOTENCY_PREFIX, *parts))
+
+def stripe_http_error(action: str, e: StripeGatewayError) -> HTTPException:
+    if isinstance(e, StripeUnavailableError):
+        # Breaker open or bulkhead full: tell the client to back off instead of piling on
+        return HTTPException(
+            status_code=503,
+            detail=f"Stripe temporarily unavailable ({action}), retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
+    return HTTPException(status_code=500, detail=f"Stripe error ({action}): {str(e)}")
+
+# ----------------------------------------
+# Stripe Customer Provisioning
+# ----------------------------------------
+def _store_customer_id(user_id: int, customer_id: str) -> bool:
+    db = database.SessionLocal()
+    try:
+        updated = db.execute(
+            update(models.UserProfile)
+            .where(models.UserProfile.id == user_id, models.UserProfile.stripe_customer_id.is_(None))
+            .values(stripe_customer_id=customer_id)
+        ).rowcount
+        db.commit()
+    finally:
+        db.close()
+    return updated == 1
+
+async def ensure_customer(gateway: StripeGateway, user_id: int, username: str) -> str:
+    # One idempotency key per user: signup provisioning, retries and checkout all get the same customer
+    customer = await gateway.create_customer(email=username, idempotency_key=idempotency_key("customer", user_id))
+    if await run_in_threadpool(_store_customer_id, user_id, customer["id"]):
+        database.mark_written(username)
+        auth.invalidate_principal(username)
+    return customer["id"]
+
+async def provision_customer(user_id: int, username: str):
+    # Runs as a BackgroundTask after signup responds; create_checkout retries if it failed
+    try:
+        await ensure_customer(await get_stripe_gateway(), user_id, username)
+    except StripeGatewayError as e:
+        log_event(logger, logging.WARNING, "payments.customer_provision_failed", user_id=user_id, error=str(e))
 
 # ----------------------------------------
 # Create Stripe Checkout Session
@@ -15,56 +71,71 @@ DOMAIN = config.DOMAIN
 @router.get("/create_checkout/")
 async def create_checkout(
     current_user: models.UserProfile = Depends(auth.get_current_user),
-    db: Session = Depends(auth.get_db),
+    gateway: StripeGateway = Depends(get_stripe_gateway),
+    db: Session = Depends(database.get_db),
 ):
-    if not current_user.stripe_customer_id:
+    # The principal is loaded; don't hold the connection across Stripe calls
+    await run_in_threadpool(database.release_connection, db)
+    # Repeat clicks reuse the open session until Stripe expires it
+    checkout_url = checkout_session_cache.get(current_user.username)
+    if checkout_url:
+        return {"checkout_url": checkout_url}
+
+    customer_id = current_user.stripe_customer_id
+    if not customer_id:
         try:
-            customer = stripe.Customer.create(email=current_user.username)
-            current_user.stripe_customer_id = customer.id
-            db.commit()
-            db.refresh(current_user)
-        except stripe.error.StripeError as e:
-            raise HTTPException(status_code=500, detail=f"Stripe error (creating customer): {str(e)}")
-
+            customer_id = await ensure_customer(gateway, current_user.id, current_user.username)
+        except StripeGatewayError as e:
+            raise stripe_http_error("creating customer", e)
+
+    # Clicks within the same minute share an idempotency key (and identical params), so
+    # concurrent requests on other workers get the same session back from Stripe
+    window = int(time.time()) // 60 * 60
+    expires_at = window + CHECKOUT_SESSION_TTL_SECONDS  # >= 30 min from now: config requires TTL >= 1860
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await gateway.create_checkout_session(
+            idempotency_key=idempotency_key("checkout", current_user.id, window),
             payment_method_types=["card"],
             line_items=[{"price": PRICE_ID, "quantity": 1}],
             mode="subscription",
-            customer=current_user.stripe_customer_id,  # ✅ Only customer, not customer_email
-            success_url=f"{DOMAIN}/api/payment/success/?username={current_user.username}&session_id={{CHECKOUT_SESSION_ID}}",
+            customer=customer_id,  # ✅ Only customer, not customer_email
+            client_reference_id=str(current_user.id),  # maps checkout.session.completed back to the user
+            success_url=f"{DOMAIN}/success?session_id={{CHECKOUT_SESSION_ID}}",
             cancel_url=f"{DOMAIN}/api/payment/cancel/",
+            expires_at=expires_at,
         )
-    except stripe.error.StripeError as e:
-        raise HTTPException(status_code=500, detail=f"Stripe error (creating checkout): {str(e)}")
+    except StripeGatewayError as e:
+        raise stripe_http_error("creating checkout", e)
 
-    return {"checkout_url": checkout_session.url}
+    # Stop handing out the URL a minute before Stripe expires the session
+    checkout_session_cache.set(current_user.username, checkout_session["url"], ttl=expires_at - time.time() - 60)
+    return {"checkout_url": checkout_session["url"]}
 
 # ----------------------------------------
 # Payment Success (redirect target)
 # ----------------------------------------
 @router.get("/success/")
 async def payment_success(
-    username: str,
     session_id: str,
-    db: Session = Depends(auth.get_db),
+    wait: float = Query(0, ge=0, le=CHECKOUT_STATUS_MAX_WAIT_SECONDS),
+    db: Session = Depends(database.get_db),
 ):
-    user = db.query(models.UserProfile).filter(models.UserProfile.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        customer_id = session.get("customer")
-    except stripe.error.StripeError as e:
-        raise HTTPException(status_code=500, detail=f"Stripe error (retrieving session): {str(e)}")
-
-    user.is_subscribed = True
-    if not user.stripe_customer_id:
-        user.stripe_customer_id = customer_id
-    db.commit()
-
-    return {"message": "Subscription successful!"}
+    # Activation happens in the webhook worker; this only reads its progress.
+    # With ?wait=N it long-polls until checkout.session.completed is applied.
+    deadline = time.monotonic() + wait
+    while True:
+        checkout_status = await run_in_threadpool(webhook_inbox.checkout_status, db, session_id)
+        await run_in_threadpool(database.release_connection, db)
+        # A delayed payment can take days to clear; stop polling once the session is known to be unpaid
+        if checkout_status in ("complete", "awaiting_payment") or time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(CHECKOUT_STATUS_POLL_SECONDS)
+
+    if checkout_status == "complete":
+        return {"status": checkout_status, "message": "Subscription successful!"}
+    if checkout_status == "awaiting_payment":
+        return {"status": checkout_status, "message": "Checkout complete; the subscription activates once the payment clears"}
+    return {"status": checkout_status, "message": "Waiting for Stripe to confirm the subscription"}
 
 # ----------------------------------------
 # Payment Cancel
@@ -79,49 +150,41 @@ async def payment_cancel():
 @router.get("/billing-portal/")
 async def billing_portal(
     current_user: models.UserProfile = Depends(auth.get_current_user),
-    db: Session = Depends(auth.get_db),
+    gateway: StripeGateway = Depends(get_stripe_gateway),
+    db: Session = Depends(database.get_db),
 ):
+    await run_in_threadpool(database.release_connection, db)
     if not current_user.stripe_customer_id:
         raise HTTPException(status_code=400, detail="User has no active Stripe customer.")
 
     try:
-        session = stripe.billing_portal.Session.create(
+        session = await gateway.create_billing_portal_session(
             customer=current_user.stripe_customer_id,
             return_url=f"{DOMAIN}/profile",
         )
-    except stripe.error.StripeError as e:
-        raise HTTPException(status_code=500, detail=f"Stripe error (billing portal): {str(e)}")
+    except StripeGatewayError as e:
+        raise stripe_http_error("billing portal", e)
 
-    return {"portal_url": session.url}
+    return {"portal_url": session["url"]}
 
 # ----------------------------------------
 # Stripe Webhook
 # ----------------------------------------
 @router.post("/webhook/")
-async def stripe_webhook(request: Request, db: Session = Depends(auth.get_db)):
+async def stripe_webhook(request: Request, db: Session = Depends(database.get_db)):
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
     webhook_secret = config.STRIPE_WEBHOOK_SECRET
+    import stripe  # the SDK is only used to verify signatures; keep it off the startup path
 
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
+        stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid payload")
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    # Listen for subscription changes (cancel, update, delete)
-    if event["type"] in ["customer.subscription.updated", "customer.subscription.deleted"]:
-        subscription = event["data"]["object"]
-        customer_id = subscription["customer"]
-        status = subscription["status"]  # e.g., 'active', 'canceled', 'incomplete'
-
-        user = db.query(models.UserProfile).filter(
-            models.UserProfile.stripe_customer_id == customer_id
-        ).first()
-
-        if user:
-            user.is_subscribed = status == "active"
-            db.commit()
+    # Persist and ack immediately; webhook_inbox.worker applies it in the background
+    await run_in_threadpool(webhook_inbox.enqueue, db, payload)
 
-    return {"status": "success"}
\ No newline at end of file
+    return {"status": "success"}
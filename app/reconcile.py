@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+from sqlalchemy import or_, select, text, update
+
+from . import config, database, entitlements, logs, models
+from .entitlements import ENTITLED_STATUSES
+from .cache import principal_cache
+from .logs import log_event
+from .stripe_gateway import StripeGateway, close_stripe_gateway, get_stripe_gateway
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# Checkpoint
+# -----------------------
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, state: dict):
+    # Write-then-rename so a crash never leaves a truncated checkpoint; the temp name is unique per writer
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            json.dump(state, fh)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def clear_checkpoint(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# -----------------------
+# Single Runner Lock
+# -----------------------
+class RunLock:
+    """Keeps one reconcile running across every worker and process.
+
+    On PostgreSQL a session advisory lock, held on a dedicated connection for
+    the whole run; elsewhere (SQLite, local runs) an flock next to the
+    checkpoint file. ``acquire`` never waits: a second runner just skips.
+    """
+
+    KEY = zlib.crc32(b"app.reconcile")
+
+    def __init__(self, engine, checkpoint_path: str):
+        self.engine = engine
+        self.lock_path = f"{checkpoint_path}.lock"
+        self._conn = None
+        self._fh = None
+
+    def acquire(self) -> bool:
+        if self.engine.dialect.name == "postgresql":
+            conn = self.engine.connect()
+            if conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.KEY}).scalar():
+                conn.commit()
+                self._conn = conn
+                return True
+            conn.close()
+            return False
+
+        import fcntl
+
+        fh = open(self.lock_path, "a")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fh.close()
+            return False
+        self._fh = fh
+        return True
+
+    def release(self):
+        if self._conn is not None:
+            self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.KEY})
+            self._conn.close()
+            self._conn = None
+        if self._fh is not None:
+            self._fh.close()  # closing drops the flock
+            self._fh = None
+
+# -----------------------
+# Reconciler
+# -----------------------
+class SubscriptionReconciler:
+    """Repairs ``is_subscribed`` drift left by missed webhooks.
+
+    Entitled means a subscription in ``ENTITLED_STATUSES`` (active or
+    trialing). Phase "stripe" streams entitled subscriptions, one status
+    at a time, and turns on customers the DB has as unsubscribed. Phase
+    "db" walks DB subscribers by ``stripe_customer_id`` and turns off
+    those Stripe has no entitled subscription for (confirmed per customer before writing, at most
+    ``concurrency`` lookups in flight). Only rows whose value actually
+    changes are updated, one ``IN (...)`` per chunk, and the cursor is
+    checkpointed after every chunk.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        gateway: StripeGateway,
+        chunk_size: int,
+        page_size: int,
+        checkpoint_path: str,
+        concurrency: int = config.RECONCILE_CONCURRENCY,
+    ):
+        self.session_factory = session_factory
+        self.gateway = gateway
+        self.chunk_size = chunk_size
+        self.page_size = page_size
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.as_of = None  # epoch seconds the run started; set by run()
+
+    def _set_subscribed(self, customer_ids: list, subscribed: bool) -> list:
+        # Same newest-wins guard as the webhook inbox: a webhook event created after the run
+        # started is newer than anything this run read from Stripe, so it is left alone
+        last_created = models.UserProfile.subscription_event_created
+        db = self.session_factory()
+        database.use_primary(db)
+        try:
+            usernames = db.execute(
+                update(models.UserProfile)
+                .where(
+                    models.UserProfile.stripe_customer_id.in_(customer_ids),
+                    models.UserProfile.is_subscribed.isnot(subscribed),
+                    or_(last_created.is_(None), last_created < self.as_of),
+                )
+                .values(is_subscribed=subscribed, subscription_event_created=self.as_of)
+                .returning(models.UserProfile.username)
+            ).scalars().all()
+            db.commit()
+        finally:
+            db.close()
+        for username in usernames:
+            database.mark_written(username)
+            principal_cache.invalidate(username)
+            entitlements.store.set(username, subscribed)
+        return usernames
+
+    def _db_subscribers_after(self, after: str) -> list:
+        # Keyset pagination on the unique stripe_customer_id index
+        db = self.session_factory()
+        try:
+            query = (
+                select(models.UserProfile.stripe_customer_id)
+                .where(
+                    models.UserProfile.is_subscribed.is_(True),
+                    models.UserProfile.stripe_customer_id.isnot(None),
+                )
+                .order_by(models.UserProfile.stripe_customer_id)
+                .limit(self.chunk_size)
+            )
+            if after is not None:
+                query = query.where(models.UserProfile.stripe_customer_id > after)
+            return db.execute(query).scalars().all()
+        finally:
+            db.close()
+
+    async def _has_active_subscription(self, customer_id: str) -> bool:
+        # Stripe filters on one status per call; most customers match on the first
+        for status in ENTITLED_STATUSES:
+            page = await self.gateway.list_subscriptions(limit=1, customer=customer_id, status=status)
+            if page["data"]:
+                return True
+        return False
+
+    async def _still_active(self, customer_ids: list) -> list:
+        # Bounded fan-out: a chunk must not take every bulkhead slot from request traffic
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(customer_id):
+            async with semaphore:
+                return await self._has_active_subscription(customer_id)
+
+        tasks = [asyncio.ensure_future(check(customer_id)) for customer_id in customer_ids]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            # One failure aborts the run; don't leave the rest queued against Stripe
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _progress(self, state: dict):
+        state["updated_at"] = datetime.utcnow().isoformat()
+        save_checkpoint(self.checkpoint_path, state)
+        log_event(logger, logging.INFO, "reconcile.progress", **state)
+
+    async def run(self, resume: bool = True) -> dict:
+        state = load_checkpoint(self.checkpoint_path) if resume else None
+        if state is None:
+            state = {
+                "phase": "stripe",
+                "stripe_status": ENTITLED_STATUSES[0],
+                "stripe_cursor": None,
+                "db_cursor": None,
+                "subscriptions_scanned": 0,
+                "db_rows_scanned": 0,
+                "activated": 0,
+                "deactivated": 0,
+                "started_at": datetime.utcnow().isoformat(),
+                "started_epoch": int(time.time()),
+            }
+        else:
+            log_event(logger, logging.INFO, "reconcile.resumed", **state)
+        # Checkpoints from before started_epoch existed resume as of now
+        self.as_of = state.setdefault("started_epoch", int(time.time()))
+
+        # Seen-active customers spare most Stripe lookups in phase "db"; after a
+        # resume the set is partial and the per-customer check covers the rest
+        active_seen = set()
+
+        if state["phase"] == "stripe":
+            # The cursor belongs to stripe_status; checkpoints without it were listing "active"
+            first = ENTITLED_STATUSES.index(state.setdefault("stripe_status", ENTITLED_STATUSES[0]))
+            for status in ENTITLED_STATUSES[first:]:
+                if status != state["stripe_status"]:
+                    state.update(stripe_status=status, stripe_cursor=None)
+                    self._progress(state)
+                chunk = []
+                async for subscription in self.gateway.iter_subscriptions(
+                    page_size=self.page_size, starting_after=state["stripe_cursor"], status=status
+                ):
+                    chunk.append(subscription)
+                    if len(chunk) >= self.chunk_size:
+                        await self._apply_active_chunk(chunk, state, active_seen)
+                        chunk = []
+                if chunk:
+                    await self._apply_active_chunk(chunk, state, active_seen)
+            state["phase"] = "db"
+            self._progress(state)
+
+        while True:
+            customer_ids = await asyncio.to_thread(self._db_subscribers_after, state["db_cursor"])
+            if not customer_ids:
+                break
+            candidates = [customer_id for customer_id in customer_ids if customer_id not in active_seen]
+            still_active = await self._still_active(candidates)
+            lapsed = [customer_id for customer_id, active in zip(candidates, still_active) if not active]
+            if lapsed:
+                changed = await asyncio.to_thread(self._set_subscribed, lapsed, False)
+                state["deactivated"] += len(changed)
+            state["db_rows_scanned"] += len(customer_ids)
+            state["db_cursor"] = customer_ids[-1]
+            self._progress(state)
+
+        clear_checkpoint(self.checkpoint_path)
+        state["phase"] = "done"
+        log_event(logger, logging.INFO, "reconcile.finished", **state)
+        return state
+
+    async def _apply_active_chunk(self, chunk: list, state: dict, active_seen: set):
+        customer_ids = {subscription["customer"] for subscription in chunk}
+        active_seen.update(customer_ids)
+        changed = await asyncio.to_thread(self._set_subscribed, list(customer_ids), True)
+        state["activated"] += len(changed)
+        state["subscriptions_scanned"] += len(chunk)
+        state["stripe_cursor"] = chunk[-1]["id"]
+        self._progress(state)
+
+# -----------------------
+# Background Task
+# -----------------------
+class ReconcileScheduler:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_result = None
+        self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_result = await reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("reconcile.failed")
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def reconcile(resume: bool = True, checkpoint_path: str = None) -> dict:
+    checkpoint_path = checkpoint_path or config.RECONCILE_CHECKPOINT_PATH
+    # Every uvicorn worker runs a scheduler; only the one holding the lock reconciles
+    lock = RunLock(database.engine, checkpoint_path)
+    if not await asyncio.to_thread(lock.acquire):
+        log_event(logger, logging.INFO, "reconcile.skipped", reason="another run holds the lock")
+        return {"phase": "skipped"}
+    try:
+        reconciler = SubscriptionReconciler(
+            session_factory=database.SessionLocal,
+            gateway=await get_stripe_gateway(),
+            chunk_size=config.RECONCILE_CHUNK_SIZE,
+            page_size=config.RECONCILE_PAGE_SIZE,
+            checkpoint_path=checkpoint_path,
+        )
+        return await reconciler.run(resume=resume)
+    finally:
+        await asyncio.to_thread(lock.release)
+
+
+scheduler = ReconcileScheduler(interval=config.RECONCILE_INTERVAL_SECONDS)
+
+
+async def _main(args):
+    logs.setup_logging()
+    try:
+        return await reconcile(resume=not args.restart, checkpoint_path=args.checkpoint)
+    finally:
+        await close_stripe_gateway()
+        logs.shutdown_logging()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile user_profiles.is_subscribed with Stripe")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--checkpoint", default=config.RECONCILE_CHECKPOINT_PATH)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_main(args))))
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import config, database, models
+from .logs import log_event
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# Session Store
+# -----------------------
+def hash_jti(jti: str) -> str:
+    return hashlib.sha256(jti.encode("utf-8")).hexdigest()
+
+
+def create(db: Session, user_id: int, jti: str, expires_at: datetime):
+    db.execute(
+        insert(models.RefreshSession).values(
+            jti_hash=hash_jti(jti),
+            user_id=user_id,
+            expires_at=expires_at,
+            created_at=datetime.utcnow(),
+        )
+    )
+
+
+def consume(db: Session, jti: str):
+    """Deletes a live session by jti (one PK lookup) and returns its user_id, or None."""
+    return db.execute(
+        delete(models.RefreshSession)
+        .where(
+            models.RefreshSession.jti_hash == hash_jti(jti),
+            models.RefreshSession.expires_at > datetime.utcnow(),
+        )
+        .returning(models.RefreshSession.user_id)
+    ).scalar()
+
+
+def revoke(db: Session, jti: str):
+    db.execute(delete(models.RefreshSession).where(models.RefreshSession.jti_hash == hash_jti(jti)))
+
+
+def revoke_all(db: Session, user_id: int):
+    db.execute(delete(models.RefreshSession).where(models.RefreshSession.user_id == user_id))
+
+# -----------------------
+# Expiry Purge
+# -----------------------
+def purge_expired(session_factory, batch_size: int) -> int:
+    # Small batches keep each DELETE's locks and WAL short
+    total = 0
+    while True:
+        db = session_factory()
+        try:
+            expired = (
+                select(models.RefreshSession.jti_hash)
+                .where(models.RefreshSession.expires_at < datetime.utcnow())
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            deleted = db.execute(
+                delete(models.RefreshSession).where(models.RefreshSession.jti_hash.in_(expired))
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+class RefreshSessionPurger:
+    def __init__(self, session_factory, interval: float, batch_size: int):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.purged_total = 0
+        self._task = None
+
+    async def run(self):
+        while True:
+            try:
+                purged = await asyncio.to_thread(purge_expired, self.session_factory, self.batch_size)
+                self.purged_total += purged
+                if purged:
+                    log_event(logger, logging.INFO, "refresh_sessions.purged", count=purged)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("refresh_sessions.purge_failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+purger = RefreshSessionPurger(
+    session_factory=database.SessionLocal,
+    interval=config.REFRESH_PURGE_INTERVAL_SECONDS,
+    batch_size=config.REFRESH_PURGE_BATCH_SIZE,
+)
@@ -0,0 +1,112 @@
+import argparse
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy import event, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from . import config, database, models
+from .logs import log_event
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# Fingerprint
+# -----------------------
+def fingerprint(metadata=models.Base.metadata, dialect=None) -> str:
+    """sha256 of the DDL the models compile to; changes whenever a table, column or index does."""
+    dialect = dialect or database.engine.dialect
+    ddl = []
+    for table in metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)).strip())
+        for index in sorted(table.indexes, key=lambda index: index.name or ""):
+            ddl.append(str(CreateIndex(index).compile(dialect=dialect)).strip())
+    return hashlib.sha256("\n".join(ddl).encode("utf-8")).hexdigest()
+
+
+def stored_fingerprint(engine) -> str:
+    table = models.SchemaFingerprint.__table__
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(table.c.fingerprint).where(table.c.id == 1)).scalar()
+    except DBAPIError:
+        return None  # not stamped yet: the table itself is missing
+
+
+def stamp(engine, value: str = None):
+    table = models.SchemaFingerprint.__table__
+    table.create(bind=engine, checkfirst=True)
+    # Upsert, so workers booting together cannot trip over each other's row
+    values = {"id": 1, "fingerprint": value or fingerprint(), "stamped_at": datetime.utcnow()}
+    with engine.begin() as conn:
+        conn.execute(database.upsert(table, values, index_elements=["id"]))
+
+# -----------------------
+# Startup Modes
+# -----------------------
+def create(engine) -> list:
+    """create_all, stamping the fingerprint only if it built the whole schema; returns the tables created."""
+    metadata = models.Base.metadata
+    created = []
+
+    def record(target, connection, tables=(), **kw):
+        created.extend(tables)  # only the tables checkfirst found missing
+
+    event.listen(metadata, "after_create", record)
+    try:
+        metadata.create_all(bind=engine)
+    finally:
+        event.remove(metadata, "after_create", record)
+
+    if len(created) == len(metadata.tables):
+        stamp(engine)
+        return created
+    # create_all never adds or alters columns of existing tables, so their shape is unverified
+    expected, stored = fingerprint(), stored_fingerprint(engine)
+    if stored != expected:
+        log_event(
+            logger, logging.WARNING, "schema.fingerprint_mismatch",
+            stored=stored, expected=expected, created_tables=[table.name for table in created],
+            hint="migrate the database, then run `python -m app.schema stamp`",
+        )
+    return created
+
+
+def check(engine):
+    expected = fingerprint()
+    stored = stored_fingerprint(engine)
+    if stored != expected:
+        raise RuntimeError(
+            f"Database schema fingerprint {stored or '(none)'} does not match the models ({expected}). "
+            "Migrate the database, then run `python -m app.schema stamp`."
+        )
+
+
+def prepare(mode: str = None, engine=None):
+    """Runs at startup. "check" costs one SELECT instead of create_all's catalog queries per table."""
+    mode = mode or config.DB_SCHEMA_MODE
+    engine = engine or database.engine
+    if mode == "create":
+        create(engine)
+    elif mode == "check":
+        check(engine)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the stored schema fingerprint")
+    parser.add_argument("command", choices=("fingerprint", "check", "stamp", "create"))
+    args = parser.parse_args()
+    if args.command == "fingerprint":
+        print(fingerprint())
+    elif args.command == "check":
+        check(database.engine)
+        print("ok")
+    elif args.command == "stamp":
+        stamp(database.engine)
+        print(fingerprint())
+    else:
+        create(database.engine)
+        check(database.engine)
+        print(fingerprint())
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic import BaseModel, EmailStr
 
 class UserProfileCreate(BaseModel):
@@ -19,3 +20,7 @@ class Token(BaseModel):
 
 class TokenRefreshRequest(BaseModel):
     refresh_token: str
+
+class UserImportResult(BaseModel):
+    created: int
+    duplicates: List[str]
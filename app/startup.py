@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from . import IMPORT_STARTED
+
+# -----------------------
+# Startup Timer
+# -----------------------
+class StartupTimer:
+    """Wall-clock milliseconds per startup phase, measured from the first import of ``app``."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases = {}
+        self.ready_ms = None
+
+    def mark(self, name: str):
+        self.phases[name] = round((time.perf_counter() - self.started) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def ready(self):
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def report(self) -> dict:
+        return {"ready_ms": self.ready_ms, "phases_ms": dict(self.phases)}
+
+
+timer = StartupTimer(IMPORT_STARTED)
+
+# -----------------------
+# Timing Report CLI
+# -----------------------
+def import_times(top: int) -> list:
+    """Runs `python -X importtime -c "import app.main"` in a fresh interpreter; returns the slowest imports."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=root, capture_output=True, text=True, check=True,
+    )
+    # Lines come children-first; a module's parent is the next line at a shallower depth
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        lines.append((depth, name.strip(), int(cumulative) / 1000))
+
+    # Third-party packages and our own modules, as imported directly by an app module
+    rows = []
+    for i, (depth, name, ms) in enumerate(lines):
+        parent = next((other for d, other, _ in lines[i + 1:] if d < depth), "")
+        if parent.startswith("app"):
+            rows.append((ms, name))
+    return sorted(rows, reverse=True)[:top]
+
+
+async def _measure_startup() -> dict:
+    # Run as __main__, this module is a second copy; app.main marks the timer in app.startup
+    from . import startup
+    from .main import app
+
+    async with app.router.lifespan_context(app):
+        return startup.timer.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import and startup timings for app.main")
+    parser.add_argument("--top", type=int, default=15, help="slowest top-level imports to list")
+    args = parser.parse_args()
+
+    # Startup first: the importtime subprocess would otherwise count towards the in-process timings
+    report = asyncio.run(_measure_startup())
+    print(json.dumps({
+        "slowest_imports_ms": [{"module": module, "ms": round(ms, 1)} for ms, module in import_times(args.top)],
+        "startup": report,
+    }, indent=2))
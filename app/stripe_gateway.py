@@ -0,0 +1,546 @@
+import asyncio
+import itertools
+import random
+import time
+from collections import deque
+
+from . import config, metrics
+
+# -----------------------
+# Errors
+# -----------------------
+class StripeGatewayError(Exception):
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StripeUnavailableError(StripeGatewayError):
+    """Failed fast without reaching Stripe: circuit open or bulkhead full."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, status_code=503)
+        self.retry_after = retry_after
+
+
+def is_transient(error: StripeGatewayError) -> bool:
+    # Network errors, timeouts, rate limits and 5xx; other 4xx mean Stripe answered fine
+    return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+
+# -----------------------
+# Gateway Interface
+# -----------------------
+class StripeGateway:
+    """The subset of the Stripe API this app uses, as async calls returning dicts."""
+
+    async def create_customer(self, email: str, idempotency_key: str = None) -> dict:
+        raise NotImplementedError
+
+    async def create_checkout_session(self, idempotency_key: str = None, **params) -> dict:
+        raise NotImplementedError
+
+    async def retrieve_checkout_session(self, session_id: str) -> dict:
+        raise NotImplementedError
+
+    async def create_billing_portal_session(self, customer: str, return_url: str) -> dict:
+        raise NotImplementedError
+
+    async def list_subscriptions(self, limit: int = 100, starting_after: str = None, **filters) -> dict:
+        """One page, newest first: {"data": [...], "has_more": bool}."""
+        raise NotImplementedError
+
+    async def iter_subscriptions(self, page_size: int = 100, starting_after: str = None, **filters):
+        # Auto-pagination: one page in memory at a time
+        while True:
+            page = await self.list_subscriptions(limit=page_size, starting_after=starting_after, **filters)
+            for subscription in page["data"]:
+                yield subscription
+            if not page.get("has_more") or not page["data"]:
+                return
+            starting_after = page["data"][-1]["id"]
+
+    async def aclose(self):
+        pass
+
+
+def _encode_params(params: dict, prefix: str = None) -> list:
+    # Stripe expects form-encoded bodies with bracketed keys for nested values
+    pairs = []
+    for key, value in params.items():
+        if value is None:
+            continue
+        name = f"{prefix}[{key}]" if prefix else key
+        if isinstance(value, dict):
+            pairs.extend(_encode_params(value, name))
+        elif isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                if isinstance(item, dict):
+                    pairs.extend(_encode_params(item, f"{name}[{index}]"))
+                else:
+                    pairs.append((f"{name}[{index}]", item))
+        elif isinstance(value, bool):
+            pairs.append((name, "true" if value else "false"))
+        else:
+            pairs.append((name, value))
+    return pairs
+
+# -----------------------
+# HTTP Implementation
+# -----------------------
+class HttpStripeGateway(StripeGateway):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = config.STRIPE_API_BASE,
+        timeout: float = config.STRIPE_TIMEOUT_SECONDS,
+        max_connections: int = config.STRIPE_MAX_CONNECTIONS,
+    ):
+        import httpx  # only the real backend needs it; the fake gateway and CLIs start without it
+
+        self._http_error = httpx.HTTPError
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            auth=(api_key, ""),
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: dict = None,
+        idempotency_key: str = None,
+    ) -> dict:
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        kwargs = {"headers": headers}
+        if method == "GET":
+            kwargs["params"] = _encode_params(params or {})
+        else:
+            kwargs["data"] = _encode_params(params or {})
+
+        try:
+            response = await self._client.request(method, path, **kwargs)
+        except self._http_error as e:
+            raise StripeGatewayError(f"{type(e).__name__}: {e}") from e
+
+        try:
+            body = response.json()
+        except ValueError:
+            raise StripeGatewayError(
+                f"Unexpected response from Stripe: {response.text[:200]}",
+                status_code=response.status_code,
+            )
+        if response.status_code >= 400:
+            message = body.get("error", {}).get("message", response.text)
+            raise StripeGatewayError(message, status_code=response.status_code)
+        return body
+
+    async def create_customer(self, email: str, idempotency_key: str = None) -> dict:
+        return await self._request(
+            "POST",
+            "/v1/customers",
+            {"email": email},
+            idempotency_key=idempotency_key,
+        )
+
+    async def create_checkout_session(self, idempotency_key: str = None, **params) -> dict:
+        return await self._request(
+            "POST",
+            "/v1/checkout/sessions",
+            params,
+            idempotency_key=idempotency_key,
+        )
+
+    async def retrieve_checkout_session(self, session_id: str) -> dict:
+        return await self._request(
+            "GET",
+            f"/v1/checkout/sessions/{session_id}",
+        )
+
+    async def create_billing_portal_session(self, customer: str, return_url: str) -> dict:
+        return await self._request(
+            "POST",
+            "/v1/billing_portal/sessions",
+            {"customer": customer, "return_url": return_url},
+        )
+
+    async def list_subscriptions(self, limit: int = 100, starting_after: str = None, **filters) -> dict:
+        return await self._request(
+            "GET",
+            "/v1/subscriptions",
+            {"limit": limit, "starting_after": starting_after, **filters},
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+# -----------------------
+# In-process Fake (load tests, local runs)
+# -----------------------
+class FakeStripeGateway(StripeGateway):
+    def __init__(self, base_url: str = config.DOMAIN, latency: float = 0.0, error_rate: float = 0.0):
+        self.base_url = base_url
+        # Fault injection: every call sleeps ``latency`` seconds and fails with a 500 at ``error_rate``
+        self.latency = latency
+        self.error_rate = error_rate
+        self.customers = {}
+        self.checkout_sessions = {}
+        self.subscriptions = {}
+        self._ids = itertools.count(1)
+        self._idempotent = {}
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}_fake{next(self._ids):08d}"
+
+    async def _simulate(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise StripeGatewayError("Injected fake Stripe failure", status_code=500)
+
+    def _once(self, idempotency_key: str, create):
+        if idempotency_key is None:
+            return create()
+        if idempotency_key not in self._idempotent:
+            self._idempotent[idempotency_key] = create()
+        return self._idempotent[idempotency_key]
+
+    async def create_customer(self, email: str, idempotency_key: str = None) -> dict:
+        await self._simulate()
+        def create():
+            customer = {"id": self._new_id("cus"), "object": "customer", "email": email}
+            self.customers[customer["id"]] = customer
+            return customer
+
+        return self._once(idempotency_key, create)
+
+    async def create_checkout_session(self, idempotency_key: str = None, **params) -> dict:
+        await self._simulate()
+        def create():
+            session_id = self._new_id("cs")
+            session = {
+                "id": session_id,
+                "object": "checkout.session",
+                "url": f"{self.base_url}/fake-stripe/checkout/{session_id}",
+                "status": "open",
+                "created": int(time.time()),
+                **params,
+            }
+            self.checkout_sessions[session_id] = session
+            return session
+
+        return self._once(idempotency_key, create)
+
+    async def retrieve_checkout_session(self, session_id: str) -> dict:
+        await self._simulate()
+        session = self.checkout_sessions.get(session_id)
+        if session is None:
+            raise StripeGatewayError(f"No such checkout.session: '{session_id}'", status_code=404)
+        return session
+
+    async def create_billing_portal_session(self, customer: str, return_url: str) -> dict:
+        await self._simulate()
+        if customer not in self.customers:
+            raise StripeGatewayError(f"No such customer: '{customer}'", status_code=404)
+        session_id = self._new_id("bps")
+        return {
+            "id": session_id,
+            "object": "billing_portal.session",
+            "customer": customer,
+            "return_url": return_url,
+            "url": f"{self.base_url}/fake-stripe/billing/{session_id}",
+        }
+
+    def add_subscription(self, customer: str, status: str = "active") -> dict:
+        subscription = {
+            "id": self._new_id("sub"),
+            "object": "subscription",
+            "customer": customer,
+            "status": status,
+            "created": int(time.time()),
+        }
+        self.subscriptions[subscription["id"]] = subscription
+        return subscription
+
+    async def list_subscriptions(self, limit: int = 100, starting_after: str = None, **filters) -> dict:
+        await self._simulate()
+        ordered = list(reversed(self.subscriptions.values()))
+        if starting_after is not None:
+            ids = [subscription["id"] for subscription in ordered]
+            if starting_after not in ids:
+                raise StripeGatewayError(f"No such subscription: '{starting_after}'", status_code=400)
+            ordered = ordered[ids.index(starting_after) + 1:]
+        # Like Stripe, canceled subscriptions are only listed with status=all or status=canceled
+        status = filters.get("status")
+        matches = [
+            subscription for subscription in ordered
+            if (status == "all" or subscription["status"] == status
+                or (status is None and subscription["status"] != "canceled"))
+            and filters.get("customer") in (None, subscription["customer"])
+        ]
+        return {"object": "list", "data": matches[:limit], "has_more": len(matches) > limit}
+
+# -----------------------
+# Instrumentation
+# -----------------------
+class InstrumentedStripeGateway(StripeGateway):
+    # Records count/latency per operation for /metrics around any gateway
+    def __init__(self, inner: StripeGateway):
+        self.inner = inner
+
+    async def _call(self, operation: str, *args, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await getattr(self.inner, operation)(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            metrics.observe_stripe_call(operation, time.perf_counter() - start, ok)
+
+    async def create_customer(self, email: str, idempotency_key: str = None) -> dict:
+        return await self._call("create_customer", email, idempotency_key=idempotency_key)
+
+    async def create_checkout_session(self, idempotency_key: str = None, **params) -> dict:
+        return await self._call("create_checkout_session", idempotency_key=idempotency_key, **params)
+
+    async def retrieve_checkout_session(self, session_id: str) -> dict:
+        return await self._call("retrieve_checkout_session", session_id)
+
+    async def create_billing_portal_session(self, customer: str, return_url: str) -> dict:
+        return await self._call("create_billing_portal_session", customer, return_url)
+
+    async def list_subscriptions(self, limit: int = 100, starting_after: str = None, **filters) -> dict:
+        return await self._call("list_subscriptions", limit=limit, starting_after=starting_after, **filters)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+# -----------------------
+# Resilience
+# -----------------------
+class CircuitBreaker:
+    """Opens when the error rate over a sliding window crosses a threshold.
+
+    While open every call fails fast. After ``cooldown`` seconds one probe
+    call is let through (half-open); its outcome closes or re-opens it.
+    """
+
+    def __init__(self, error_rate: float, min_calls: int, window: float, cooldown: float, on_state_change=None):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.on_state_change = on_state_change
+        self.state = "closed"
+        self._outcomes = deque()  # (timestamp, ok)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        if on_state_change:
+            on_state_change(self.state)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            if self.on_state_change:
+                self.on_state_change(state)
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._failures = 0
+        self._set_state("open")
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._set_state("half_open")
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record(self, ok):
+        """ok=None means the call was cancelled; it only frees the half-open probe."""
+        if self.state == "half_open":
+            self._probe_in_flight = False
+            if ok:
+                self._set_state("closed")
+            elif ok is False:
+                self._open()
+            return
+        if ok is None:
+            return
+
+        now = time.monotonic()
+        self._outcomes.append((now, ok))
+        self._failures += not ok
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, expired_ok = self._outcomes.popleft()
+            self._failures -= not expired_ok
+        if len(self._outcomes) >= self.min_calls and self._failures / len(self._outcomes) >= self.error_rate:
+            self._open()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+
+class ResilientStripeGateway(StripeGateway):
+    """Bulkhead, per-operation timeouts, circuit breaker and retries around a gateway.
+
+    At most ``max_concurrency`` calls wait on Stripe at once; callers that
+    cannot get a slot within ``bulkhead_wait`` seconds fail fast, so a slow
+    Stripe cannot tie up every request in the worker. Only reads and calls
+    carrying an idempotency key are retried, with full-jitter backoff.
+    """
+
+    READ_OPERATIONS = frozenset({"retrieve_checkout_session", "list_subscriptions"})
+
+    def __init__(
+        self,
+        inner: StripeGateway,
+        breaker: CircuitBreaker,
+        max_concurrency: int,
+        bulkhead_wait: float,
+        timeout: float,
+        operation_timeouts: dict = None,
+        retry_attempts: int = 2,
+        retry_base: float = 0.2,
+        retry_max: float = 2.0,
+    ):
+        self.inner = inner
+        self.breaker = breaker
+        self.max_concurrency = max_concurrency
+        self.bulkhead_wait = bulkhead_wait
+        self.timeout = timeout
+        # Per-operation overrides of ``timeout``, e.g. {"retrieve_checkout_session": 3}
+        self.operation_timeouts = operation_timeouts or {}
+        self.retry_attempts = retry_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.in_flight = 0
+        self._bulkhead = asyncio.Semaphore(max_concurrency)
+
+    async def _attempt(self, operation: str, *args, **kwargs):
+        if not self.breaker.allow():
+            metrics.observe_stripe_rejected(operation, "circuit_open")
+            raise StripeUnavailableError("Stripe circuit breaker is open", retry_after=self.breaker.retry_after())
+        try:
+            await asyncio.wait_for(self._bulkhead.acquire(), self.bulkhead_wait)
+        except asyncio.TimeoutError:
+            self.breaker.record(None)
+            metrics.observe_stripe_rejected(operation, "bulkhead_full")
+            raise StripeUnavailableError("Too many concurrent Stripe calls", retry_after=1.0)
+
+        timeout = self.operation_timeouts.get(operation, self.timeout)
+        ok = None
+        self.in_flight += 1
+        try:
+            result = await asyncio.wait_for(getattr(self.inner, operation)(*args, **kwargs), timeout)
+            ok = True
+            return result
+        except asyncio.TimeoutError:
+            ok = False
+            raise StripeGatewayError(f"Stripe {operation} timed out after {timeout}s")
+        except StripeGatewayError as e:
+            ok = not is_transient(e)
+            raise
+        finally:
+            self.in_flight -= 1
+            self._bulkhead.release()
+            self.breaker.record(ok)
+
+    async def _call(self, operation: str, *args, **kwargs):
+        retryable = operation in self.READ_OPERATIONS or kwargs.get("idempotency_key") is not None
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(operation, *args, **kwargs)
+            except StripeUnavailableError:
+                raise
+            except StripeGatewayError as e:
+                if not retryable or attempt >= self.retry_attempts or not is_transient(e):
+                    raise
+            # Full jitter spreads retries from many callers instead of synchronising them
+            await asyncio.sleep(random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt)))
+            attempt += 1
+            metrics.observe_stripe_retry(operation)
+
+    async def create_customer(self, email: str, idempotency_key: str = None) -> dict:
+        return await self._call("create_customer", email, idempotency_key=idempotency_key)
+
+    async def create_checkout_session(self, idempotency_key: str = None, **params) -> dict:
+        return await self._call("create_checkout_session", idempotency_key=idempotency_key, **params)
+
+    async def retrieve_checkout_session(self, session_id: str) -> dict:
+        return await self._call("retrieve_checkout_session", session_id)
+
+    async def create_billing_portal_session(self, customer: str, return_url: str) -> dict:
+        return await self._call("create_billing_portal_session", customer, return_url)
+
+    async def list_subscriptions(self, limit: int = 100, starting_after: str = None, **filters) -> dict:
+        return await self._call("list_subscriptions", limit=limit, starting_after=starting_after, **filters)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "breaker_retry_after_seconds": round(self.breaker.retry_after(), 2) if self.breaker.state == "open" else 0,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+        }
+
+# -----------------------
+# Dependency
+# -----------------------
+_gateway: StripeGateway = None
+
+
+async def get_stripe_gateway() -> StripeGateway:
+    global _gateway
+    if _gateway is None:
+        if config.STRIPE_BACKEND == "fake":
+            backend = FakeStripeGateway(
+                latency=config.STRIPE_FAKE_LATENCY_MS / 1000,
+                error_rate=config.STRIPE_FAKE_ERROR_RATE,
+            )
+        else:
+            backend = HttpStripeGateway(api_key=config.STRIPE_API_KEY)
+        # Metrics see every attempt that reaches Stripe; the resilience layer sits outside
+        _gateway = ResilientStripeGateway(
+            InstrumentedStripeGateway(backend),
+            breaker=CircuitBreaker(
+                error_rate=config.STRIPE_BREAKER_ERROR_RATE,
+                min_calls=config.STRIPE_BREAKER_MIN_CALLS,
+                window=config.STRIPE_BREAKER_WINDOW_SECONDS,
+                cooldown=config.STRIPE_BREAKER_COOLDOWN_SECONDS,
+                on_state_change=metrics.set_stripe_breaker_state,
+            ),
+            max_concurrency=config.STRIPE_MAX_CONCURRENCY,
+            bulkhead_wait=config.STRIPE_BULKHEAD_WAIT_SECONDS,
+            timeout=config.STRIPE_TIMEOUT_SECONDS,
+            operation_timeouts={
+                "retrieve_checkout_session": config.STRIPE_READ_TIMEOUT_SECONDS,
+                "list_subscriptions": config.STRIPE_READ_TIMEOUT_SECONDS,
+            },
+            retry_attempts=config.STRIPE_RETRY_ATTEMPTS,
+            retry_base=config.STRIPE_RETRY_BASE_SECONDS,
+            retry_max=config.STRIPE_RETRY_MAX_SECONDS,
+        )
+    return _gateway
+
+
+async def close_stripe_gateway():
+    global _gateway
+    if _gateway is not None:
+        await _gateway.aclose()
+        _gateway = None
@@ -0,0 +1,171 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException, status
+
+from . import config
+
+# -----------------------
+# Backends
+# -----------------------
+class MemoryThrottleBackend:
+    """Sliding-window log per key, in this process only.
+
+    Keys are kept in LRU order and capped at ``max_keys`` so a flood of
+    random usernames cannot grow memory without bound.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, window: float, now: float) -> deque:
+        hits = self._windows.get(key)
+        if hits is None:
+            return None
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        return hits
+
+    async def acquire(self, limits: list) -> float:
+        """Takes one slot in every (key, limit, window), or none; returns 0 or the seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            retry_after = 0.0
+            for key, limit, window in limits:
+                hits = self._live(key, window, now)
+                if hits is not None and len(hits) >= limit:
+                    retry_after = max(retry_after, hits[0] + window - now)
+            if retry_after:
+                return retry_after
+            for key, limit, window in limits:
+                hits = self._windows.get(key)
+                if hits is None:
+                    hits = self._windows[key] = deque()
+                hits.append(now)
+                self._windows.move_to_end(key)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+            return 0.0
+
+    async def reset(self, key: str):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    async def release(self, key: str):
+        with self._lock:
+            hits = self._windows.get(key)
+            if hits:
+                hits.pop()
+
+
+class RedisThrottleBackend:
+    """Sliding windows in Redis sorted sets, shared by every worker (needs the redis package)."""
+
+    # Check every key first and only record the attempt if all of them have room
+    _ACQUIRE = """
+    local now = tonumber(ARGV[1])
+    local retry_after = 0
+    for i, key in ipairs(KEYS) do
+        local limit = tonumber(ARGV[i * 2])
+        local window = tonumber(ARGV[i * 2 + 1])
+        redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+        if redis.call('ZCARD', key) >= limit then
+            local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+            retry_after = math.max(retry_after, tonumber(oldest[2]) + window - now)
+        end
+    end
+    if retry_after > 0 then
+        return tostring(retry_after)
+    end
+    for i, key in ipairs(KEYS) do
+        redis.call('ZADD', key, now, ARGV[#ARGV] .. ':' .. i)
+        redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[i * 2 + 1])))
+    end
+    return '0'
+    """
+
+    def __init__(self, url: str, prefix: str = "login-throttle:"):
+        import redis.asyncio as redis  # optional dependency, only for shared throttling
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._acquire = self._redis.register_script(self._ACQUIRE)
+        self._ids = 0
+
+    async def acquire(self, limits: list) -> float:
+        now = time.time()
+        self._ids += 1
+        args = [now]
+        for _, limit, window in limits:
+            args += [limit, window]
+        args.append(f"{now}:{id(self)}:{self._ids}")  # unique sorted-set member per attempt
+        keys = [self.prefix + key for key, _, _ in limits]
+        return float(await self._acquire(keys=keys, args=args))
+
+    async def reset(self, key: str):
+        await self._redis.delete(self.prefix + key)
+
+    async def release(self, key: str):
+        await self._redis.zpopmax(self.prefix + key)
+
+# -----------------------
+# Login Throttle
+# -----------------------
+class LoginThrottle:
+    """Caps login attempts per username and per client IP.
+
+    Runs before any DB or bcrypt work. A successful login clears the
+    username's window and gives its IP slot back, so in effect only failed
+    (or still running) attempts count against either limit.
+    """
+
+    def __init__(self, backend, username_limit: int, username_window: float, ip_limit: int, ip_window: float):
+        self.backend = backend
+        self.username_limit = username_limit
+        self.username_window = username_window
+        self.ip_limit = ip_limit
+        self.ip_window = ip_window
+        self.throttled = 0
+
+    async def check(self, username: str, client_ip: str):
+        limits = [(f"user:{username.lower()}", self.username_limit, self.username_window)]
+        if client_ip:
+            limits.append((f"ip:{client_ip}", self.ip_limit, self.ip_window))
+        retry_after = await self.backend.acquire(limits)
+        if retry_after:
+            self.throttled += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts, try again later",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+    async def succeeded(self, username: str, client_ip: str):
+        await self.backend.reset(f"user:{username.lower()}")
+        if client_ip:
+            await self.backend.release(f"ip:{client_ip}")
+
+    async def abandoned(self, username: str, client_ip: str):
+        # The attempt errored (e.g. hash pool full) before the password was judged; it doesn't count
+        await self.backend.release(f"user:{username.lower()}")
+        if client_ip:
+            await self.backend.release(f"ip:{client_ip}")
+
+
+def _backend():
+    if config.LOGIN_THROTTLE_REDIS_URL:
+        return RedisThrottleBackend(config.LOGIN_THROTTLE_REDIS_URL)
+    return MemoryThrottleBackend(max_keys=config.LOGIN_THROTTLE_MAX_KEYS)
+
+
+login_throttle = LoginThrottle(
+    backend=_backend(),
+    username_limit=config.LOGIN_THROTTLE_USERNAME_LIMIT,
+    username_window=config.LOGIN_THROTTLE_USERNAME_WINDOW_SECONDS,
+    ip_limit=config.LOGIN_THROTTLE_IP_LIMIT,
+    ip_window=config.LOGIN_THROTTLE_IP_WINDOW_SECONDS,
+)
@@ -1,48 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from . import models, schemas, auth
+from . import models, schemas, auth, database, payments
 
 router = APIRouter(prefix="/api/authentication", tags=["authentication"])
 
+def create_user(db: Session, username: str, hashed_password: str):
+    """One INSERT ... ON CONFLICT DO NOTHING RETURNING; returns None if the username is taken."""
+    table = models.UserProfile.__table__
+    row = db.execute(
+        database.insert_ignore(table)
+        .values(username=username, hashed_password=hashed_password, is_subscribed=False)
+        .returning(table.c.id, table.c.username, table.c.is_subscribed)
+    ).first()
+    db.commit()
+    if row is not None:
+        database.mark_written(username)
+    return row
+
 @router.post("/signup/", response_model=schemas.UserProfileOut, status_code=status.HTTP_201_CREATED)
-async def signup(user: schemas.UserProfileCreate, db: Session = Depends(auth.get_db)) -> models.UserProfile:
-    db_user = db.query(models.UserProfile).filter(models.UserProfile.username == user.username).first()
-    if db_user:
+async def signup(
+    user: schemas.UserProfileCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
+) -> dict:
+    # No existence pre-check: the conflict-aware INSERT is the check, and it cannot race
+    hashed_password = await auth.get_password_hash(user.password)
+    new_user = await run_in_threadpool(create_user, db, user.username, hashed_password)
+    if new_user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
-    hashed_password = auth.get_password_hash(user.password)
-    new_user = models.UserProfile(username=user.username, hashed_password=hashed_password)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    background_tasks.add_task(payments.provision_customer, new_user.id, new_user.username)
+    return {"username": new_user.username, "is_subscribed": new_user.is_subscribed}
 
 @router.post("/login/", response_model=schemas.Token)
 async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(auth.get_db)
+    db: Session = Depends(database.get_db)
 ) -> dict:
-    username = form_data.username
-    password = form_data.password
-
-    db_user = db.query(models.UserProfile).filter(models.UserProfile.username == username).first()
-    if not db_user or not auth.verify_password(password, db_user.hashed_password):
+    db_user = await auth.authenticate_user(db, form_data.username, form_data.password, auth.client_ip(request))
+    if not db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect username or password")
 
-    access_token = auth.create_access_token(data={"sub": db_user.username})
-    refresh_token = auth.create_refresh_token(data={"sub": db_user.username})
-
-    # ✅ Save refresh token to DB
-    db_user.refresh_token = refresh_token
-    #db.add(db_user)  # Ensure changes are tracked
-    db.commit()      # Persist to database
-    db.refresh(db_user)  # Optional but good practice
-
-    return {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "token_type": "bearer",
-    }
+    # ✅ Store a new refresh session (the users row is not written)
+    return await run_in_threadpool(auth.issue_tokens, db, db_user)
 
 
 @router.get("/get_user_profile/", response_model=schemas.UserProfileOut)
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+
+from . import config, database, entitlements, models
+from .cache import checkout_session_cache, principal_cache
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_EVENTS = (
+    "customer.subscription.updated",
+    "customer.subscription.deleted",
+    "checkout.session.completed",
+    "invoice.paid",
+)
+CHECKOUT_COMPLETED = "checkout.session.completed"
+
+
+def desired_subscription_state(event_type: str, obj: dict):
+    """True/False for events that decide is_subscribed, None for ones that don't."""
+    if event_type == CHECKOUT_COMPLETED:
+        # Delayed payment methods complete checkout unpaid; invoice.paid activates those later.
+        # no_payment_required is a trial, which starts the subscription as "trialing" (entitled).
+        if obj.get("mode") == "subscription" and obj.get("payment_status") in ("paid", "no_payment_required"):
+            return True
+        return None
+    if event_type == "invoice.paid":
+        # One-off invoices carry no subscription and say nothing about access
+        return True if obj.get("subscription") else None
+    return obj.get("status") in entitlements.ENTITLED_STATUSES
+
+
+def _user_id(client_reference_id):
+    # create_checkout sets client_reference_id to the user's id
+    return int(client_reference_id) if client_reference_id and str(client_reference_id).isdigit() else None
+
+
+def _set_subscribed(db: Session, condition, subscribed: bool, created: int) -> list:
+    # Conditional on the stored event time, so concurrent workers holding older events cannot win
+    last_created = models.UserProfile.subscription_event_created
+    result = db.execute(
+        update(models.UserProfile)
+        .where(condition, or_(last_created.is_(None), last_created <= created))
+        .values(is_subscribed=subscribed, subscription_event_created=created)
+        .returning(models.UserProfile.username)
+    )
+    return [(username, subscribed) for username in result.scalars()]
+
+# -----------------------
+# Enqueue (request path)
+# -----------------------
+def enqueue(db: Session, payload: bytes) -> bool:
+    """Store an already verified event; returns False if Stripe already delivered it."""
+    event = json.loads(payload)
+    obj = event["data"]["object"]
+    customer_id = obj.get("customer")
+    if obj.get("object") == "customer":
+        customer_id = obj.get("id")
+
+    stmt = database.insert_ignore(models.WebhookEvent.__table__).values(
+        event_id=event["id"],
+        type=event["type"],
+        customer_id=customer_id,
+        object_id=obj.get("id"),
+        created=int(event["created"]),
+        payload=payload.decode("utf-8"),
+        received_at=datetime.utcnow(),
+    )
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount == 1
+
+def checkout_status(db: Session, session_id: str) -> str:
+    # "pending" until checkout.session.completed arrives, "processing" until the worker handled it,
+    # then "complete" only once the user is subscribed; unpaid (delayed payment) sessions stay
+    # "awaiting_payment" until invoice.paid activates them
+    row = (
+        db.query(models.WebhookEvent.processed_at, models.WebhookEvent.customer_id, models.WebhookEvent.payload)
+        .filter(
+            models.WebhookEvent.object_id == session_id,
+            models.WebhookEvent.type == CHECKOUT_COMPLETED,
+        )
+        .first()
+    )
+    if row is None:
+        return "pending"
+    if row.processed_at is None:
+        return "processing"
+    user_id = _user_id(json.loads(row.payload)["data"]["object"].get("client_reference_id"))
+    subscribed = (
+        db.query(models.UserProfile.is_subscribed)
+        .filter(or_(models.UserProfile.id == user_id, models.UserProfile.stripe_customer_id == row.customer_id))
+        .filter(models.UserProfile.is_subscribed.is_(True))
+        .first()
+    )
+    return "complete" if subscribed else "awaiting_payment"
+
+# -----------------------
+# Background Worker
+# -----------------------
+class WebhookInboxWorker:
+    def __init__(self, session_factory, batch_size: int, poll_interval: float, retention_days: int):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retention = timedelta(days=retention_days)
+        self.processed_total = 0
+        self.applied_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+        self.last_batch_at = None
+        self._last_purge = 0.0
+        self._task = None
+
+    def process_batch(self) -> int:
+        db = self.session_factory()
+        database.use_primary(db)
+        try:
+            events = (
+                db.query(models.WebhookEvent)
+                .filter(models.WebhookEvent.processed_at.is_(None))
+                .order_by(models.WebhookEvent.created, models.WebhookEvent.event_id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)  # lets several workers drain in parallel
+                .all()
+            )
+            if not events:
+                return 0
+            changed = []
+
+            # Newest subscription state per customer within the batch
+            latest = {}
+            by_user_id = []
+            for event in events:
+                if event.type not in SUBSCRIPTION_EVENTS:
+                    continue
+                obj = json.loads(event.payload)["data"]["object"]
+                subscribed = desired_subscription_state(event.type, obj)
+                if subscribed is None:
+                    continue
+                if event.customer_id:
+                    latest[event.customer_id] = (event, subscribed, obj)
+                elif event.type == CHECKOUT_COMPLETED and _user_id(obj.get("client_reference_id")):
+                    by_user_id.append((event, subscribed, obj))
+
+            # One conditional UPDATE per (created, state); the row lock it takes serialises
+            # workers, and the WHERE skips users that already have a newer event applied
+            updates = {}
+            for customer_id, (event, subscribed, obj) in latest.items():
+                customers, user_ids = updates.setdefault((event.created, subscribed), ([], []))
+                customers.append(customer_id)
+                if event.type == CHECKOUT_COMPLETED and _user_id(obj.get("client_reference_id")):
+                    user_ids.append(_user_id(obj.get("client_reference_id")))
+            for event, subscribed, obj in by_user_id:
+                updates.setdefault((event.created, subscribed), ([], []))[1].append(_user_id(obj.get("client_reference_id")))
+            for (created, subscribed), (customers, user_ids) in sorted(updates.items()):
+                applied = _set_subscribed(db, or_(
+                    models.UserProfile.stripe_customer_id.in_(customers),
+                    models.UserProfile.id.in_(user_ids),
+                ), subscribed, created)
+                changed.extend(applied)
+                self.applied_total += len(applied)
+
+            db.query(models.WebhookEvent).filter(
+                models.WebhookEvent.event_id.in_([event.event_id for event in events])
+            ).update({models.WebhookEvent.processed_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            for username, subscribed in changed:
+                database.mark_written(username)
+                principal_cache.invalidate(username)
+                checkout_session_cache.invalidate(username)
+                entitlements.store.set(username, subscribed)
+
+            self.processed_total += len(events)
+            self.batches_total += 1
+            self.last_batch_at = datetime.utcnow()
+            return len(events)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def purge_processed(self) -> int:
+        db = self.session_factory()
+        try:
+            deleted = (
+                db.query(models.WebhookEvent)
+                .filter(models.WebhookEvent.processed_at < datetime.utcnow() - self.retention)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    async def run(self):
+        while True:
+            try:
+                drained = await asyncio.to_thread(self.process_batch)
+                if drained < self.batch_size:
+                    if time.monotonic() - self._last_purge > 3600:
+                        self._last_purge = time.monotonic()
+                        await asyncio.to_thread(self.purge_processed)
+                    await asyncio.sleep(self.poll_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors_total += 1
+                logger.exception("Webhook inbox batch failed")
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self, db: Session) -> dict:
+        backlog, oldest = (
+            db.query(func.count(models.WebhookEvent.event_id), func.min(models.WebhookEvent.received_at))
+            .filter(models.WebhookEvent.processed_at.is_(None))
+            .one()
+        )
+        return {
+            "backlog": backlog,
+            "lag_seconds": (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+            "processed_total": self.processed_total,
+            "applied_total": self.applied_total,
+            "batches_total": self.batches_total,
+            "errors_total": self.errors_total,
+            "last_batch_at": self.last_batch_at.isoformat() if self.last_batch_at else None,
+        }
+
+
+worker = WebhookInboxWorker(
+    session_factory=database.SessionLocal,
+    batch_size=config.WEBHOOK_BATCH_SIZE,
+    poll_interval=config.WEBHOOK_POLL_INTERVAL_SECONDS,
+    retention_days=config.WEBHOOK_RETENTION_DAYS,
+)
@@ -0,0 +1,451 @@
+"""In-process load benchmark for the auth, refresh, profile, checkout, webhook, signup and logout paths.
+
+Boots the app against a throwaway SQLite database with the fake Stripe
+backend, drives concurrent requests through httpx's ASGI transport and
+prints a JSON report (throughput, p50/p95/p99 latency, DB statements and
+pool connection checkouts per request per scenario). Exits non-zero if a
+scenario goes over its budget in QUERY_BUDGETS or CHECKOUT_BUDGETS.
+
+Afterwards it reconciles subscriptions against the fake Stripe (a full run,
+then a resume from a phase "db" checkpoint) with added Stripe latency, and
+fails if any drift is left or the reconciler exceeds RECONCILE_CONCURRENCY
+Stripe calls in flight.
+
+    python benchmarks/bench.py --requests 500 --concurrency 32 --output bench.json
+    python benchmarks/bench.py --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import collections
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("login", "refresh", "profile", "checkout", "webhook", "signup", "logout")
+# Max mean DB statements per request. Profile and checkout are mostly cache hits.
+# Signup includes the background UPDATE that stores the pre-provisioned Stripe customer.
+# Logout re-reads the principal because each logout invalidates it.
+QUERY_BUDGETS = {
+    "login": 2,     # SELECT user, INSERT refresh session
+    "refresh": 2,   # DELETE ... RETURNING session, INSERT new session
+    "profile": 1,
+    "checkout": 1,
+    "webhook": 1,   # INSERT ... ON CONFLICT DO NOTHING into the inbox
+    "signup": 2,    # INSERT ... ON CONFLICT DO NOTHING RETURNING, background customer UPDATE
+    "logout": 2,    # principal SELECT, DELETE refresh session
+}
+# Max mean pool connection checkouts per request: auth and the route share one request-scoped
+# session. Login hands its connection back while bcrypt runs and checks out again to store the
+# refresh session; signup's background customer UPDATE uses a session of its own.
+CHECKOUT_BUDGETS = {name: 1 for name in SCENARIOS}
+CHECKOUT_BUDGETS.update(login=2, signup=2)
+WEBHOOK_SECRET = "whsec_benchmark"
+# Per-call fake Stripe latency during the reconcile check; high enough that an unbounded
+# fan-out would overrun the bulkhead's wait
+RECONCILE_LATENCY_SECONDS = 0.05
+
+
+def configure_environment(db_path: str):
+    # Must run before app.config is imported
+    os.environ.update(
+        SECRET_KEY="benchmark-secret",
+        STRIPE_API_KEY="sk_test_benchmark",
+        STRIPE_PRICE_ID="price_benchmark",
+        STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+        STRIPE_BACKEND="fake",
+        DATABASE_URL=f"sqlite:///{db_path}",
+        LOG_LEVEL="WARNING",  # keep JSON log lines (startup.ready etc.) out of the report on stdout
+        RECONCILE_CHECKPOINT_PATH=os.path.join(os.path.dirname(db_path), "reconcile-checkpoint.json"),
+    )
+    sys.path.insert(0, ROOT)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def sign_webhook(payload: str, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+# -----------------------
+# Fixtures
+# -----------------------
+def seed_users(count: int, password: str) -> list:
+    from app import database, hashing, models
+
+    hashed = hashing.pwd_context.hash(password)  # one hash, shared by every seeded user
+    users = [
+        {
+            "username": f"bench{i}@example.com",
+            "hashed_password": hashed,
+            "is_subscribed": False,
+            "stripe_customer_id": f"cus_bench{i:06d}",
+        }
+        for i in range(count)
+    ]
+    with database.SessionLocal() as db:
+        db.execute(models.UserProfile.__table__.insert(), users)
+        db.commit()
+    return [user["username"] for user in users]
+
+
+async def login_all(client, usernames: list, password: str) -> dict:
+    tokens = {}
+    for username in usernames:
+        response = await client.post(
+            "/api/authentication/login/", data={"username": username, "password": password}
+        )
+        response.raise_for_status()
+        tokens[username] = response.json()
+    return tokens
+
+class RequestQueryCounter:
+    """Counts DB statements and pool checkouts issued inside a request (background workers are excluded)."""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        from sqlalchemy.pool import Pool
+
+        from app import metrics
+
+        self.count = 0
+        self.checkouts = 0
+
+        @event.listens_for(Engine, "before_cursor_execute")
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            if metrics.current_request_stats() is not None:
+                self.count += 1
+
+        @event.listens_for(Pool, "checkout")
+        def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+            if metrics.current_request_stats() is not None:
+                self.checkouts += 1
+
+# -----------------------
+# Reconcile Check
+# -----------------------
+async def check_reconcile(latency: float) -> dict:
+    from sqlalchemy import func, select, update
+
+    from app import config, database, models, reconcile, webhook_inbox
+    from app.stripe_gateway import get_stripe_gateway
+
+    users = models.UserProfile
+    # Settle the load phase's webhooks first so they cannot flip rows mid-check
+    while await asyncio.to_thread(webhook_inbox.worker.process_batch):
+        pass
+
+    gateway = await get_stripe_gateway()
+    fake = gateway.inner.inner  # Resilient -> Instrumented -> FakeStripeGateway
+    with database.SessionLocal() as db:
+        customer_ids = db.execute(
+            select(users.stripe_customer_id).where(users.stripe_customer_id.isnot(None)).order_by(users.id)
+        ).scalars().all()
+    fake.subscriptions.clear()
+    active = customer_ids[::2]
+    for customer_id in active:
+        fake.add_subscription(customer_id)
+
+    def set_db_subscribers(subscribed: list):
+        with database.SessionLocal() as db:
+            db.execute(update(users).values(
+                is_subscribed=users.stripe_customer_id.in_(subscribed), subscription_event_created=None
+            ))
+            db.commit()
+
+    def drift() -> int:
+        with database.SessionLocal() as db:
+            return db.execute(
+                select(func.count())
+                .select_from(users)
+                .where(users.stripe_customer_id.isnot(None), users.is_subscribed.isnot(users.stripe_customer_id.in_(active)))
+            ).scalar()
+
+    peak = 0
+
+    async def track_in_flight():
+        nonlocal peak
+        while True:
+            peak = max(peak, gateway.stats()["in_flight"])
+            await asyncio.sleep(0.005)
+
+    report = {"customers": len(customer_ids)}
+    tracker = asyncio.create_task(track_in_flight())
+    fake.latency = latency
+    started = time.perf_counter()
+    try:
+        # Full run: every active customer starts unsubscribed and vice versa
+        await asyncio.to_thread(set_db_subscribers, customer_ids[1::2])
+        full = await reconcile.reconcile(resume=False)
+        report.update(activated=full["activated"], deactivated=full["deactivated"])
+        report["drift"] = await asyncio.to_thread(drift)
+
+        # Resume in phase "db" with no seen-active set: every DB subscriber is checked against Stripe
+        await asyncio.to_thread(set_db_subscribers, customer_ids)
+        reconcile.save_checkpoint(config.RECONCILE_CHECKPOINT_PATH, dict(full, phase="db", db_cursor=None))
+        resumed = await reconcile.reconcile(resume=True)
+        report["resumed_deactivated"] = resumed["deactivated"] - full["deactivated"]  # counters carry over
+        report["drift"] += await asyncio.to_thread(drift)
+    except Exception as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        fake.latency = 0.0
+        tracker.cancel()
+    report["duration_s"] = round(time.perf_counter() - started, 4)
+    report["stripe_in_flight_max"] = peak
+    report["concurrency_limit"] = config.RECONCILE_CONCURRENCY
+    return report
+
+
+def reconcile_failures(report: dict) -> list:
+    failures = []
+    if "error" in report:
+        failures.append(f"run failed: {report['error']}")
+    if report.get("drift"):
+        failures.append(f"{report['drift']} users still out of sync with Stripe")
+    if report["stripe_in_flight_max"] > report["concurrency_limit"]:
+        failures.append(f"{report['stripe_in_flight_max']} Stripe calls in flight (limit {report['concurrency_limit']})")
+    return failures
+
+# -----------------------
+# Load Driver
+# -----------------------
+async def drive(make_request, total: int, concurrency: int, queries: RequestQueryCounter = None) -> dict:
+    latencies, errors = [], 0
+    queries_before = queries.count if queries else 0
+    checkouts_before = queries.checkouts if queries else 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(counter) < total:
+            start = time.perf_counter()
+            response = await make_request()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [value * 1000 for value in latencies]
+    db_queries = (queries.count - queries_before) if queries else 0
+    checkouts = (queries.checkouts - checkouts_before) if queries else 0
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "db_queries_per_request": round(db_queries / len(ms), 3) if ms else 0.0,
+        "db_checkouts_per_request": round(checkouts / len(ms), 3) if ms else 0.0,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(len(ms) / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 3) if ms else 0.0,
+            "p50": round(percentile(ms, 50), 3),
+            "p95": round(percentile(ms, 95), 3),
+            "p99": round(percentile(ms, 99), 3),
+            "max": round(ms[-1], 3) if ms else 0.0,
+        },
+    }
+
+
+async def run_benchmarks(args) -> dict:
+    import httpx
+
+    from app.main import app
+
+    rng = random.Random(args.seed)
+    password = "benchmark-password"
+    event_ids = itertools.count()
+    signup_ids = itertools.count()
+    queries = RequestQueryCounter()
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        usernames = seed_users(args.users, password)  # after startup has created the schema
+        # Refresh tokens rotate, so each in-flight refresh needs a user of its own
+        sample = usernames[: min(len(usernames), max(args.token_users, args.concurrency))]
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenarios:
+                tokens = await login_all(client, sample, password) if name not in ("webhook", "signup") else {}
+
+                def headers_for(username):
+                    return {"Authorization": f"Bearer {tokens[username]['access_token']}"}
+
+                if name == "login":
+                    def make_request():
+                        return client.post(
+                            "/api/authentication/login/",
+                            data={"username": rng.choice(usernames), "password": password},
+                        )
+                elif name == "refresh":
+                    idle = collections.deque(sample)
+
+                    async def make_request():
+                        username = idle.popleft()
+                        response = await client.post(
+                            "/api/authentication/token/refresh/",
+                            data={"refresh_token": tokens[username]["refresh_token"]},
+                        )
+                        if response.status_code == 200:
+                            tokens[username] = response.json()
+                        idle.append(username)
+                        return response
+                elif name == "profile":
+                    def make_request():
+                        return client.get("/api/authentication/get_user_profile/", headers=headers_for(rng.choice(sample)))
+                elif name == "checkout":
+                    def make_request():
+                        return client.get("/api/payment/create_checkout/", headers=headers_for(rng.choice(sample)))
+                elif name == "signup":
+                    def make_request():
+                        return client.post(
+                            "/api/authentication/signup/",
+                            json={"username": f"signup{next(signup_ids)}@example.com", "password": password},
+                        )
+                elif name == "logout":
+                    def make_request():
+                        username = rng.choice(sample)
+                        return client.post(
+                            "/api/authentication/logout/",
+                            data={"refresh_token": tokens[username]["refresh_token"]},
+                            headers=headers_for(username),
+                        )
+                else:
+                    def make_request():
+                        index = rng.randrange(len(usernames))
+                        payload = json.dumps({
+                            "id": f"evt_bench{next(event_ids):08d}",
+                            "type": "customer.subscription.updated",
+                            "created": int(time.time()),
+                            "data": {"object": {
+                                "id": f"sub_bench{index:06d}",
+                                "object": "subscription",
+                                "customer": f"cus_bench{index:06d}",
+                                "status": rng.choice(("active", "canceled")),
+                            }},
+                        })
+                        return client.post(
+                            "/api/payment/webhook/",
+                            content=payload,
+                            headers={"stripe-signature": sign_webhook(payload), "content-type": "application/json"},
+                        )
+
+                if args.warmup:
+                    await drive(make_request, args.warmup, args.concurrency)
+                results[name] = await drive(make_request, args.requests, args.concurrency, queries)
+        reconcile_report = await check_reconcile(RECONCILE_LATENCY_SECONDS)
+    return results, reconcile_report
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if current["latency_ms"]["p95"] > previous["latency_ms"]["p95"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {previous['latency_ms']['p95']}ms -> {current['latency_ms']['p95']}ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def over_budget(results: dict) -> list:
+    failures = []
+    for name, result in results.items():
+        if result["db_queries_per_request"] > QUERY_BUDGETS[name]:
+            failures.append(f"{name}: {result['db_queries_per_request']} DB statements/request (budget {QUERY_BUDGETS[name]})")
+        if result["db_checkouts_per_request"] > CHECKOUT_BUDGETS[name]:
+            failures.append(
+                f"{name}: {result['db_checkouts_per_request']} connection checkouts/request (budget {CHECKOUT_BUDGETS[name]})"
+            )
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=300, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=200, help="seeded user rows")
+    parser.add_argument("--token-users", type=int, default=20, help="users logged in for token-based scenarios")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write the JSON report here as well as stdout")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed fractional slowdown")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(os.path.join(tmp, "bench.db"))
+        results, reconcile_report = asyncio.run(run_benchmarks(args))
+
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": int(time.time()),
+            "params": {
+                key: getattr(args, key)
+                for key in ("requests", "warmup", "concurrency", "users", "token_users", "seed")
+            },
+        },
+        "scenarios": results,
+        "reconcile": reconcile_report,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+
+    failures = over_budget(results)
+    for line in failures:
+        print(f"OVER BUDGET {line}", file=sys.stderr)
+    for line in reconcile_failures(reconcile_report):
+        print(f"RECONCILE {line}", file=sys.stderr)
+        failures.append(line)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        failures += regressions
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())